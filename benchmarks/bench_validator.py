@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+##
+
+"""
+Per-instance cost of ModelValidator with and without the compiled plan.
+
+Usage: PYTHONPATH=. python benchmarks/bench_validator.py [iterations]
+"""
+
+import sys
+import timeit
+from typing import Dict, List, Optional
+
+from opslib.osm.validator import (
+    _compile_model,
+    _run_plan,
+    ModelValidator,
+    validator,
+)
+
+
+class ConfigModel(ModelValidator):
+    log_level: str
+    port: int
+    database_commonkey: str
+    mongodb_uri: Optional[str]
+    enable_test: Optional[bool]
+    ingress_whitelist_source_range: Optional[str]
+    tls_secret_name: Optional[str]
+    site_url: Optional[str]
+    ports: Optional[List[int]]
+    labels: Optional[Dict[str, str]]
+
+    @validator("log_level")
+    def validate_log_level(cls, v):
+        if v not in {"INFO", "DEBUG"}:
+            raise ValueError("value must be INFO or DEBUG")
+        return v
+
+
+DATA = {
+    "log_level": "INFO",
+    "port": 9999,
+    "database_commonkey": "osm",
+    "mongodb_uri": "mongodb://mongo:27017",
+    "enable_test": False,
+    "site_url": "http://nbi",
+    "ports": [9999],
+    "labels": {"app": "nbi"},
+}
+
+
+def uncompiled():
+    plan, decorator_validators = _compile_model(ConfigModel)
+    return _run_plan(plan, decorator_validators, dict(DATA))
+
+
+def compiled():
+    return ConfigModel(**DATA)
+
+
+def main(iterations: int):
+    for name, function in (("uncompiled", uncompiled), ("compiled", compiled)):
+        seconds = min(timeit.repeat(function, number=iterations, repeat=5))
+        print(f"{name:>10}: {seconds / iterations * 1e6:8.2f} us/instance")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# For those usages not covered by the Apache License, Version 2.0 please
+# contact: legal@canonical.com
+#
+# To get in touch with the maintainers, please contact:
+# osm-charmers@lists.launchpad.net
+##
+
+__all__ = ["HOOK_TOOL_METHODS", "HookToolStats", "HookToolReport", "InstrumentedBackend"]
+
+
+from collections import defaultdict
+import functools
+import sys
+import threading
+import time
+from typing import Dict, List, NamedTuple, Tuple
+
+import ops.framework
+import ops.model
+
+# Methods of the model backend that run a hook tool
+HOOK_TOOL_METHODS = (
+    "relation_ids",
+    "relation_list",
+    "relation_remote_app_name",
+    "relation_get",
+    "relation_set",
+    "config_get",
+    "is_leader",
+    "resource_get",
+    "pod_spec_set",
+    "status_get",
+    "status_set",
+    "storage_list",
+    "storage_get",
+    "storage_add",
+    "action_get",
+    "action_set",
+    "action_log",
+    "action_fail",
+    "application_version_set",
+    "juju_log",
+    "network_get",
+    "add_metrics",
+)
+
+# Maximum number of frames inspected to find the caller of a hook tool
+CALLER_MAX_DEPTH = 32
+
+
+class HookToolStats(NamedTuple):
+    calls: int
+    time: float
+
+    def __add__(self, other):
+        return HookToolStats(self.calls + other.calls, self.time + other.time)
+
+
+class HookToolReport:
+    """
+    Hook tool calls of a hook, by caller and command
+
+    :param: stats: Dictionary with (caller, command) tuples as keys, and
+                   HookToolStats as values
+    """
+
+    def __init__(self, stats: Dict[Tuple[str, str], HookToolStats]):
+        self.stats = stats
+
+    @property
+    def calls(self) -> int:
+        return sum(stats.calls for stats in self.stats.values())
+
+    @property
+    def time(self) -> float:
+        return sum(stats.time for stats in self.stats.values())
+
+    def by_caller(self) -> Dict[str, HookToolStats]:
+        return self._group(0)
+
+    def by_command(self) -> Dict[str, HookToolStats]:
+        return self._group(1)
+
+    def lines(self) -> List[str]:
+        """One line per caller and command, the most expensive first"""
+        return [
+            f"{caller} {command}: {stats.calls} calls, {stats.time:.3f}s"
+            for (caller, command), stats in sorted(
+                self.stats.items(), key=lambda item: -item[1].time
+            )
+        ]
+
+    def _group(self, index: int) -> Dict[str, HookToolStats]:
+        groups = defaultdict(lambda: HookToolStats(0, 0.0))
+        for key, stats in self.stats.items():
+            groups[key[index]] += stats
+        return dict(groups)
+
+    def __str__(self):
+        callers = ", ".join(
+            f"{caller} {stats.calls}" for caller, stats in sorted(self.by_caller().items())
+        )
+        return f"{self.calls} hook tool calls in {self.time:.3f}s ({callers})"
+
+
+class InstrumentedBackend:
+    """
+    Accounting of the hook tools run by the model backend
+
+    The methods of the backend that run a hook tool are wrapped to count
+    and time their calls. If by_caller is set, each call is attributed to
+    the closest framework Object (charm, relation client or server) in the
+    call stack, or to the module calling ops if there is none.
+
+    :param: model: Charm model whose backend is instrumented
+    :param: by_caller: Break the calls down by caller, walking the call stack
+    """
+
+    def __init__(self, model: ops.model.Model, by_caller: bool = False):
+        self.by_caller = by_caller
+        self.calls = 0
+        self._stats = defaultdict(lambda: HookToolStats(0, 0.0))
+        self._lock = threading.Lock()
+        backend = model._backend
+        for method in HOOK_TOOL_METHODS:
+            if hasattr(backend, method):
+                setattr(backend, method, self._instrumented(method, getattr(backend, method)))
+
+    def report(self) -> HookToolReport:
+        with self._lock:
+            return HookToolReport(dict(self._stats))
+
+    def _instrumented(self, name: str, method):
+        command = name.replace("_", "-")
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            caller = _caller(sys._getframe(1)) if self.by_caller else "all"
+            start = time.monotonic()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.monotonic() - start
+                with self._lock:
+                    self.calls += 1
+                    self._stats[caller, command] += HookToolStats(1, elapsed)
+
+        return wrapper
+
+
+def _caller(frame) -> str:
+    module = None
+    for _ in range(CALLER_MAX_DEPTH):
+        if frame is None:
+            break
+        name = frame.f_globals.get("__name__", "")
+        if name != "ops" and not name.startswith("ops."):
+            module = module or name
+            obj = frame.f_locals.get("self")
+            if isinstance(obj, ops.framework.Object):
+                return type(obj).__name__
+        frame = frame.f_back
+    return module or "unknown"
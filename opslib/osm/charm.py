@@ -23,12 +23,12 @@
 __all__ = ["CharmedOsmBase", "RelationsMissing"]
 
 
-import hashlib
 import json
 import logging
-from typing import Any, Dict, NoReturn
+import time
+from typing import Any, Dict, List, NoReturn, Optional
 
-from oci_image import OCIImageResource, OCIImageResourceError
+from oci_image import OCIImageResourceError
 from ops.charm import CharmBase
 from ops.framework import StoredState
 from ops.model import (
@@ -36,8 +36,28 @@ from ops.model import (
     BlockedStatus,
     MaintenanceStatus,
     ModelError,
+    WaitingStatus,
 )
 
+from .backend import InstrumentedBackend
+from .diff import (
+    compress_pod_spec,
+    decompress_pod_spec,
+    diff_pod_specs,
+    PodSpecDiff,
+    redact_pod_spec,
+)
+from .digest import (
+    FINGERPRINT_SCHEME,
+    fingerprint_scheme,
+    matches_fingerprint,
+    spec_fingerprint,
+)
+from .image import CachedImageResource
+from .interfaces.common import prefetch_relation_data
+from .metrics import MetricsRegistry, SIZE_BUCKETS
+from .pod import analyze_pod_spec_size, normalize_pod_spec, SizeBudgetExceeded
+from .profiler import HookProfile, HookProfiler
 from .validator import ValidationError
 
 logger = logging.getLogger(__name__)
@@ -57,32 +77,138 @@ class CharmedOsmBase(CharmBase):
 
     state = StoredState()
 
+    # Load the data of all relations concurrently before building the pod spec
+    prefetch_relations = False
+    prefetch_workers = 4
+    # Number of hook profiles kept in the StoredState
+    profile_history = 20
+    # Action returning the recent hook profiles, if the charm defines it
+    profile_action = "hook-profiles"
+    # Count the hook tool calls by caller, in the hook profiles and at the end of
+    # the hook. It wraps the methods of the ops model backend, so it is off by default.
+    instrument_backend = False
+    # File where the metrics are written at the end of every hook. Metrics are
+    # only observed and kept in the StoredState if it is set.
+    metrics_path = None
+    # Configure the pod once per dispatch, when the framework commits, instead
+    # of once per observed event
+    coalesce_configure_pod = False
+
     def __init__(self, *args, oci_image="image") -> NoReturn:
         """CharmedOsmBase Charm constructor."""
         super().__init__(*args)
 
         # Internal state initialization
         self.state.set_default(pod_spec=None)
+        self.state.set_default(pod_spec_inputs=None)
+        self.state.set_default(pod_spec_data=None)
+        self.state.set_default(hook_profiles=[])
+        self.state.set_default(metrics={})
+        self.prefetch_report = None
+        # Diff of the last pod spec built in this hook, None if the build was skipped
+        self.last_pod_spec_diff = None
+        self.configure_pod_requests = 0
+        self.hook_tools = None
+        if self.instrument_backend:
+            self.hook_tools = InstrumentedBackend(self.model, by_caller=True)
+        self.profiler = HookProfiler(self.hook_tools)
+        self.metrics = MetricsRegistry(self.state.metrics)
+        self._register_metrics()
 
-        self.image = OCIImageResource(self, oci_image)
+        self.image = CachedImageResource(self, oci_image)
 
         # Registering regular events
         self.framework.observe(self.on.config_changed, self.configure_pod)
         self.framework.observe(self.on.leader_elected, self.configure_pod)
+        self.framework.observe(self.on.upgrade_charm, self._on_upgrade_charm)
+        # The coalesced configure_pod runs first, to be profiled and measured
+        self.framework.observe(self.framework.on.pre_commit, self._configure_pod_once)
+        self.framework.observe(self.framework.on.pre_commit, self._save_hook_profile)
+        if self.metrics_path:
+            self.framework.observe(self.framework.on.pre_commit, self._save_metrics)
+        if self.instrument_backend:
+            self.framework.observe(self.framework.on.pre_commit, self._report_hook_tools)
+        if self.profile_action in self.meta.actions:
+            self.framework.observe(
+                self.on[self.profile_action].action, self._on_hook_profiles_action
+            )
 
     def build_pod_spec(self, image_info):
+        """
+        Assemble the pod spec
+
+        Charms using the pod spec builders should return
+        pod_spec_builder.snapshot() rather than build(): the snapshot is
+        frozen, so the digests of its unchanged parts are memoized and the
+        pod spec fingerprint is computed without hashing them again.
+
+        :param: image_info: Image information returned by the OCI image resource
+
+        :return: Pod spec
+        """
         raise NotImplementedError()
 
+    def pod_spec_inputs(self, image_info) -> Dict[str, Any]:
+        """
+        Inputs from which the pod spec is built
+
+        If the fingerprint of these inputs matches the one of the last applied
+        pod spec, build_pod_spec is skipped. Charms that build the pod spec out of
+        something else than the config, the relation data and the image
+        must extend this dictionary.
+
+        :param: image_info: Image information returned by the OCI image resource
+
+        :return: Dictionary with the config, relation data and image information
+        """
+        return {
+            "config": dict(self.config),
+            "relations": _relations_data(self.model),
+            "image": image_info,
+        }
+
+    def should_apply_pod_spec(self, diff: PodSpecDiff) -> bool:
+        """
+        Decide whether a changed pod spec is applied
+
+        Charms can override it to hold back changes that are not worth a
+        rolling restart of the pods. Changes that are not applied are
+        evaluated again in the next hook.
+
+        :param: diff: Structural differences with the last applied pod spec,
+                      secret values are replaced by digests (see redact_pod_spec)
+
+        :return: True if the pod spec must be applied
+        """
+        return True
+
     def configure_pod(self, _=None) -> NoReturn:
-        """Assemble the pod spec and apply it, if possible."""
+        """
+        Assemble the pod spec and apply it, if possible.
+
+        If coalesce_configure_pod is set, the charm is only marked as dirty,
+        and the pod is configured once when the framework commits, after all
+        the events of the dispatch (including the deferred ones) are handled.
+        The unit status then reflects the outcome of that single run.
+        """
+        if self.coalesce_configure_pod:
+            self.configure_pod_requests += 1
+            return
+        self._configure_pod()
+
+    def _configure_pod_once(self, _=None) -> NoReturn:
+        if not self.configure_pod_requests:
+            return
+        logger.debug(f"Configuring the pod once for {self.configure_pod_requests} events")
+        self.configure_pod_requests = 0
+        self._configure_pod()
+
+    def _configure_pod(self) -> NoReturn:
         try:
             if self.unit.is_leader():
-                self.unit.status = MaintenanceStatus("Assembling pod spec")
-                image_info = self.image.fetch()
-                pod_spec = self.build_pod_spec(image_info)
-                self._set_pod_spec(pod_spec)
+                self.last_pod_spec_diff = self._build_and_set_pod_spec()
 
-            self.unit.status = ActiveStatus("ready")
+            self.unit.status = self._ready_status()
         except OCIImageResourceError:
             self.unit.status = BlockedStatus("Error fetching image information")
         except ValidationError as e:
@@ -91,20 +217,178 @@ class CharmedOsmBase(CharmBase):
         except RelationsMissing as e:
             logger.error(f"Relation missing error: {e.message}")
             self.unit.status = BlockedStatus(e.message)
-        except ModelError as e:
+        except (ModelError, SizeBudgetExceeded) as e:
             self.unit.status = BlockedStatus(str(e))
         except Exception as e:
             logger.error(f"Unknown exception: {e}")
             self.unit.status = BlockedStatus(e)
 
-    def _set_pod_spec(self, pod_spec: Dict[str, Any]) -> NoReturn:
-        pod_spec_hash = _hash_from_dict(pod_spec)
-        if self.state.pod_spec != pod_spec_hash:
+    def _ready_status(self):
+        diff = self.last_pod_spec_diff
+        if diff and not diff.applied:
+            # Changes held back by should_apply_pod_spec
+            return WaitingStatus(f"Pod spec changes pending: {diff.summary()}")
+        return ActiveStatus("ready")
+
+    def _build_and_set_pod_spec(self) -> Optional[PodSpecDiff]:
+        if self.prefetch_relations:
+            with self.profiler.phase("prefetch"):
+                self.prefetch_report = prefetch_relation_data(
+                    self.model, self.prefetch_workers
+                )
+            logger.debug(f"Relation data prefetch: {self.prefetch_report}")
+        with self.profiler.phase("image"):
+            image_info = self.image.fetch()
+        with self.profiler.phase("inputs"):
+            inputs = self.pod_spec_inputs(image_info)
+            inputs_hash = _hash_from_dict(inputs)
+        if self.metrics_path:
+            # Measured from the model, pod_spec_inputs may be overridden
+            self._observe_payload_sizes(_relations_data(self.model))
+        if self.state.pod_spec_inputs == inputs_hash:
+            logger.debug("Pod spec inputs unchanged, skipping build")
+            self._pod_spec_skips.inc(reason="inputs_unchanged")
+            return None
+        self.unit.status = MaintenanceStatus("Assembling pod spec")
+        with self.profiler.phase("build"):
+            pod_spec = self.build_pod_spec(image_info)
+        self._pod_spec_builds.inc()
+        diff = self._set_pod_spec(pod_spec)
+        if diff.applied:
+            self._pod_spec_applies.inc()
+        else:
+            self._pod_spec_skips.inc(reason="not_applied" if diff else "spec_unchanged")
+        if diff.applied or not diff:
+            self.state.pod_spec_inputs = inputs_hash
+        return diff
+
+    def _set_pod_spec(self, pod_spec: Dict[str, Any]) -> PodSpecDiff:
+        with self.profiler.phase("hash"):
+            raw_pod_spec = pod_spec
+            pod_spec = normalize_pod_spec(pod_spec)
+            pod_spec_hash = _hash_from_dict(pod_spec)
+            if self.state.pod_spec == pod_spec_hash:
+                return PodSpecDiff([])
+            if self._matches_legacy_fingerprint(raw_pod_spec, pod_spec):
+                # Fingerprints stored by previous schemes are migrated without re-applying
+                self._store_pod_spec(pod_spec, pod_spec_hash)
+                return PodSpecDiff([])
+        with self.profiler.phase("diff"):
+            diff = diff_pod_specs(
+                decompress_pod_spec(self.state.pod_spec_data), redact_pod_spec(pod_spec)
+            )
+        logger.info(f"Pod spec changes: {diff.summary()}")
+        for change in diff:
+            logger.debug(f"Pod spec change: {change}")
+        if not self.should_apply_pod_spec(diff):
+            logger.info("Pod spec changes not applied")
+            return diff
+        analyze_pod_spec_size(pod_spec).check()
+        with self.profiler.phase("set_spec"):
             self.model.pod.set_spec(pod_spec)
-            self.state.pod_spec = pod_spec_hash
+            self._store_pod_spec(pod_spec, pod_spec_hash)
+        diff.applied = True
+        return diff
+
+    def _matches_legacy_fingerprint(self, *pod_specs: Dict[str, Any]) -> bool:
+        # A different fingerprint of the current scheme means the spec changed,
+        # there is no need to hash the spec again. Legacy fingerprints were
+        # computed before normalization, so the raw spec is checked first.
+        fingerprint = self.state.pod_spec
+        if not fingerprint or fingerprint_scheme(fingerprint) == FINGERPRINT_SCHEME:
+            return False
+        return any(matches_fingerprint(spec, fingerprint) for spec in pod_specs)
+
+    def _store_pod_spec(self, pod_spec: Dict[str, Any], pod_spec_hash: str) -> NoReturn:
+        # Only the redacted spec is kept, the secret values are replaced by digests
+        self.state.pod_spec = pod_spec_hash
+        self.state.pod_spec_data = compress_pod_spec(redact_pod_spec(pod_spec))
+
+    def _on_upgrade_charm(self, _=None) -> NoReturn:
+        # The new charm code may build a different pod spec from the same inputs
+        self.state.pod_spec_inputs = None
+
+    def _register_metrics(self) -> NoReturn:
+        self._hook_durations = self.metrics.histogram(
+            "osm_charm_hook_duration_seconds", "Duration of the hooks", ["hook"]
+        )
+        self._pod_spec_builds = self.metrics.counter(
+            "osm_charm_pod_spec_builds_total", "Pod specs built"
+        )
+        self._pod_spec_applies = self.metrics.counter(
+            "osm_charm_pod_spec_applies_total", "Pod specs applied"
+        )
+        self._pod_spec_skips = self.metrics.counter(
+            "osm_charm_pod_spec_skips_total",
+            "Pod spec builds or applies skipped, by reason",
+            ["reason"],
+        )
+        self._payload_sizes = self.metrics.histogram(
+            "osm_charm_relation_payload_bytes",
+            "Size of the data read from each relation",
+            ["relation"],
+            buckets=SIZE_BUCKETS,
+        )
+
+    def _observe_payload_sizes(self, relations_data: Dict[str, Any]) -> NoReturn:
+        for relation, entities in relations_data.items():
+            size = sum(
+                len(key) + len(value)
+                for data in entities.values()
+                for key, value in data.items()
+            )
+            self._payload_sizes.observe(size, relation=relation.split(":")[0])
+
+    def _save_metrics(self, _=None) -> NoReturn:
+        self._hook_durations.observe(
+            time.time() - self.profiler.started, hook=self.profiler.hook
+        )
+        self.state.metrics = self.metrics.dump()
+        try:
+            self.metrics.write(self.metrics_path)
+        except OSError as e:
+            logger.warning(f"Cannot write the metrics to {self.metrics_path}: {e}")
+
+    @property
+    def hook_profiles(self) -> List[HookProfile]:
+        """Profiles of the last hooks, oldest first"""
+        return [HookProfile.from_dict(profile) for profile in self.state.hook_profiles]
+
+    def _save_hook_profile(self, _=None) -> NoReturn:
+        profile = self.profiler.profile()
+        if not profile.phases:
+            return
+        logger.info(f"Hook profile {profile}")
+        profiles = (self.hook_profiles + [profile])[-max(self.profile_history, 1):]
+        self.state.hook_profiles = [p.to_dict() for p in profiles]
+
+    def _report_hook_tools(self, _=None) -> NoReturn:
+        report = self.hook_tools.report()
+        logger.info(f"Hook tools: {report}")
+        for line in report.lines():
+            logger.debug(f"Hook tools: {line}")
+
+    def _on_hook_profiles_action(self, event) -> NoReturn:
+        profiles = self.hook_profiles
+        event.set_results(
+            {
+                "summary": "\n".join(str(profile) for profile in profiles),
+                "profiles": json.dumps([profile.to_dict() for profile in profiles]),
+            }
+        )
+
+
+def _relations_data(model) -> Dict[str, Dict[str, Dict[str, str]]]:
+    relations_data = {}
+    for relation_name, relations in model.relations.items():
+        for relation in relations:
+            entities = [relation.app] if relation.app else []
+            entities.extend(relation.units)
+            relations_data[f"{relation_name}:{relation.id}"] = {
+                entity.name: dict(relation.data[entity]) for entity in entities
+            }
+    return relations_data
 
 
 def _hash_from_dict(dict: Dict[str, Any]) -> str:
-    dict_str = json.dumps(dict, sort_keys=True)
-    result = hashlib.md5(dict_str.encode())
-    return result.hexdigest()
+    return spec_fingerprint(dict)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# For those usages not covered by the Apache License, Version 2.0 please
+# contact: legal@canonical.com
+#
+# To get in touch with the maintainers, please contact:
+# osm-charmers@lists.launchpad.net
+##
+
+__all__ = [
+    "ChangeCategories",
+    "SpecChange",
+    "PodSpecDiff",
+    "diff_pod_specs",
+    "compress_pod_spec",
+    "decompress_pod_spec",
+    "redact_pod_spec",
+]
+
+
+import base64
+from collections import Counter
+import json
+from typing import Any, Dict, List, NamedTuple, Optional
+import zlib
+
+from .digest import canonical_chunks, stream_digest
+
+# Keys used to match the items of lists of dictionaries, instead of their position
+LIST_ITEM_KEYS = ("name", "path", "host")
+
+
+class ChangeCategories:
+    CONTAINERS = "containers"
+    ENV = "env"
+    FILES = "files"
+    PROBES = "probes"
+    INGRESS = "ingress"
+    POD = "pod"
+
+
+class SpecChange(NamedTuple):
+    path: str
+    kind: str
+    old: Any
+    new: Any
+    category: str
+
+    def __str__(self):
+        return f"{self.kind} {self.path}"
+
+
+class PodSpecDiff:
+    """Structural differences between two pod specs"""
+
+    def __init__(self, changes: List[SpecChange]):
+        self.changes = changes
+        self.applied = False
+
+    def __bool__(self):
+        return bool(self.changes)
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    def __len__(self):
+        return len(self.changes)
+
+    @property
+    def categories(self) -> Dict[str, int]:
+        return dict(Counter(change.category for change in self.changes))
+
+    @property
+    def restart_required(self) -> bool:
+        """True if the change modifies the pods, and not only the ingress resources"""
+        return any(change.category != ChangeCategories.INGRESS for change in self.changes)
+
+    def summary(self) -> str:
+        if not self.changes:
+            return "no changes"
+        categories = ", ".join(f"{k}: {v}" for k, v in sorted(self.categories.items()))
+        restart = "restart required" if self.restart_required else "no restart"
+        return f"{len(self.changes)} changes ({categories}); {restart}"
+
+
+def diff_pod_specs(old: Optional[Dict[str, Any]], new: Dict[str, Any]) -> PodSpecDiff:
+    """
+    Compute the structural differences between two pod specs
+
+    Containers, ports, volumes, files and ingress resources are matched by
+    their name, path or host, so reordering them is not reported as a change.
+
+    :param: old: Previously applied pod spec, or None if unknown
+    :param: new: Pod spec to apply
+
+    :return: PodSpecDiff with one SpecChange per added, removed or changed leaf
+    """
+    changes = []
+    _diff(old or {}, new, "", changes)
+    return PodSpecDiff(changes)
+
+
+def compress_pod_spec(pod_spec: Dict[str, Any]) -> str:
+    """Compact representation of a pod spec, suitable for the StoredState"""
+    compressor = zlib.compressobj(9)
+    data = b"".join(
+        compressor.compress(chunk.encode()) for chunk in canonical_chunks(pod_spec)
+    )
+    return base64.b64encode(data + compressor.flush()).decode()
+
+
+def decompress_pod_spec(data: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not data:
+        return None
+    return json.loads(zlib.decompress(base64.b64decode(data)).decode())
+
+
+def redact_pod_spec(pod_spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Copy of a pod spec without secret values
+
+    The environment values, the contents of the files and the data of the
+    kubernetes secrets are replaced by their digests, so changing them is
+    still reported by diff_pod_specs, but the values are not kept in the
+    StoredState.
+
+    :param: pod_spec: Pod spec
+
+    :return: Redacted copy of the pod spec
+    """
+    redacted = dict(pod_spec)
+    for key in ("containers", "initContainers"):
+        if pod_spec.get(key):
+            redacted[key] = [_redact_container(container) for container in pod_spec[key]]
+    resources = pod_spec.get("kubernetesResources")
+    if resources and resources.get("secrets"):
+        redacted["kubernetesResources"] = {
+            **resources,
+            "secrets": [
+                {
+                    **secret,
+                    **{
+                        key: _redact_values(secret[key])
+                        for key in ("data", "stringData")
+                        if key in secret
+                    },
+                }
+                for secret in resources["secrets"]
+            ],
+        }
+    return redacted
+
+
+def _redact_container(container: Dict[str, Any]) -> Dict[str, Any]:
+    redacted = dict(container)
+    if "envConfig" in container:
+        redacted["envConfig"] = _redact_values(container["envConfig"])
+    if "volumeConfig" in container:
+        redacted["volumeConfig"] = [
+            {
+                **volume,
+                "files": [
+                    {**file, "content": _redacted(file["content"])} if "content" in file else file
+                    for file in volume["files"]
+                ],
+            }
+            if "files" in volume
+            else volume
+            for volume in container["volumeConfig"]
+        ]
+    return redacted
+
+
+def _redact_values(values: Dict[str, Any]) -> Dict[str, str]:
+    return {key: _redacted(value) for key, value in values.items()}
+
+
+def _redacted(value: Any) -> str:
+    return f"redacted:{stream_digest(value)}"
+
+
+def _diff(old: Any, new: Any, path: str, changes: List[SpecChange]):
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in sorted(set(old) | set(new), key=str):
+            _diff(old.get(key), new.get(key), f"{path}.{key}" if path else key, changes)
+    elif isinstance(old, (list, tuple)) and isinstance(new, (list, tuple)):
+        _diff_lists(list(old), list(new), path, changes)
+    elif old != new:
+        kind = "added" if old is None else "removed" if new is None else "changed"
+        changes.append(SpecChange(path, kind, old, new, _category(path)))
+
+
+def _diff_lists(old: list, new: list, path: str, changes: List[SpecChange]):
+    key = _list_item_key(old, new)
+    if key:
+        old_items = {item[key]: item for item in old}
+        new_items = {item[key]: item for item in new}
+        item_keys = sorted(set(old_items) | set(new_items))
+    elif len(old) == len(new):
+        old_items, new_items = dict(enumerate(old)), dict(enumerate(new))
+        item_keys = range(len(old))
+    else:
+        if old != new:
+            changes.append(SpecChange(path, "changed", old, new, _category(path)))
+        return
+    for item_key in item_keys:
+        _diff(old_items.get(item_key), new_items.get(item_key), f"{path}[{item_key}]", changes)
+
+
+def _list_item_key(old: list, new: list) -> Optional[str]:
+    items = old + new
+    if not items or not all(isinstance(item, dict) for item in items):
+        return None
+    for key in LIST_ITEM_KEYS:
+        if all(_unique_str_values(key, items) for items in (old, new)):
+            return key
+
+
+def _unique_str_values(key: str, items: list) -> bool:
+    values = [item.get(key) for item in items]
+    return all(isinstance(v, str) for v in values) and len(set(values)) == len(values)
+
+
+def _category(path: str) -> str:
+    if path.startswith("kubernetesResources.ingressResources"):
+        return ChangeCategories.INGRESS
+    if not path.startswith("containers") and not path.startswith("initContainers"):
+        return ChangeCategories.POD
+    if ".envConfig" in path:
+        return ChangeCategories.ENV
+    if ".volumeConfig" in path:
+        return ChangeCategories.FILES
+    if "Probe" in path:
+        return ChangeCategories.PROBES
+    return ChangeCategories.CONTAINERS
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# For those usages not covered by the Apache License, Version 2.0 please
+# contact: legal@canonical.com
+#
+# To get in touch with the maintainers, please contact:
+# osm-charmers@lists.launchpad.net
+##
+
+__all__ = [
+    "canonical_chunks",
+    "stream_digest",
+    "spec_digest",
+    "spec_fingerprint",
+    "fingerprint_scheme",
+    "matches_fingerprint",
+]
+
+
+from collections import OrderedDict
+import hashlib
+import json
+from json.encoder import encode_basestring_ascii
+from typing import Any, Iterator
+
+from .frozen import FrozenDict, FrozenList
+
+DIGEST_ALGORITHM = "blake2b"
+FINGERPRINT_SCHEME = f"merkle-{DIGEST_ALGORITHM}"
+
+# Strings shorter than this are cheaper to hash than to look up in the cache
+BLOB_MIN_SIZE = 1024
+BLOB_CACHE_SIZE = 256
+# The cache keeps the strings alive, so their total size is bounded too
+BLOB_CACHE_BYTES = 16 * 1024 * 1024
+# Size of the slices in which long strings are escaped by the canonical encoder
+CHUNK_SIZE = 64 * 1024
+
+_blob_digests = OrderedDict()
+_blob_cache_bytes = 0
+
+
+def spec_digest(value: Any, algorithm: str = DIGEST_ALGORITHM) -> str:
+    """
+    Merkle digest of a JSON-like value
+
+    Every dictionary and list is hashed out of the digests of its items,
+    so equal subtrees always get equal digests. Digests of frozen containers
+    are cached in the containers, and digests of large strings (e.g. inline
+    files) are cached by content, so unchanged parts are only hashed once
+    per process.
+
+    :param: value: JSON-like value (dict, list, tuple, str, int, float, bool, None)
+    :param: algorithm: hashlib algorithm name
+
+    :return: Hexadecimal digest
+    """
+    return _digest(value, algorithm).hex()
+
+
+def spec_fingerprint(value: Any) -> str:
+    """
+    Fingerprint of a pod spec, as stored in the charm state
+
+    :return: String with the following format: <scheme>:<hexdigest>
+    """
+    return f"{FINGERPRINT_SCHEME}:{spec_digest(value)}"
+
+
+def fingerprint_scheme(fingerprint: str) -> str:
+    """Scheme of a fingerprint, or an empty string for the legacy md5 ones"""
+    return fingerprint.rpartition(":")[0] if fingerprint else ""
+
+
+def matches_fingerprint(value: Any, fingerprint: str) -> bool:
+    """
+    Check if a value matches a fingerprint computed by any known scheme
+
+    Fingerprints without a scheme are the md5 of the value dumped as JSON
+    with sorted keys, the format used by previous versions of this library.
+    """
+    if not fingerprint:
+        return False
+    scheme = fingerprint_scheme(fingerprint)
+    digest = fingerprint[len(scheme) + 1:] if scheme else fingerprint
+    if not scheme:
+        return _legacy_digest(value) == digest
+    if scheme.startswith("merkle-"):
+        return spec_digest(value, scheme[len("merkle-"):]) == digest
+    return False
+
+
+def canonical_chunks(value: Any) -> Iterator[str]:
+    """
+    Canonical JSON encoding of a value, in chunks
+
+    Concatenating the chunks gives exactly json.dumps(value, sort_keys=True,
+    default=str), but neither the whole document nor any long string in it
+    is ever materialized in a single piece.
+    """
+    if isinstance(value, str):
+        yield from _string_chunks(value)
+    elif isinstance(value, dict):
+        yield from _dict_chunks(value)
+    elif isinstance(value, (list, tuple)):
+        yield from _list_chunks(value)
+    elif value is None or isinstance(value, (bool, int, float)):
+        yield json.dumps(value)
+    else:
+        yield from _string_chunks(str(value))
+
+
+def stream_digest(value: Any, algorithm: str = DIGEST_ALGORITHM) -> str:
+    """
+    Digest of the canonical JSON encoding of a value
+
+    The encoding is streamed into the hash object, so the peak memory does
+    not depend on the size of the value.
+
+    :param: value: JSON-like value
+    :param: algorithm: hashlib algorithm name
+
+    :return: Hexadecimal digest
+    """
+    h = hashlib.new(algorithm)
+    for chunk in canonical_chunks(value):
+        h.update(chunk.encode())
+    return h.hexdigest()
+
+
+def _string_chunks(value: str) -> Iterator[str]:
+    if len(value) <= CHUNK_SIZE:
+        yield encode_basestring_ascii(value)
+        return
+    # ensure_ascii escapes code point by code point, so slices can be escaped alone
+    yield '"'
+    for i in range(0, len(value), CHUNK_SIZE):
+        yield encode_basestring_ascii(value[i:i + CHUNK_SIZE])[1:-1]
+    yield '"'
+
+
+def _dict_chunks(value: dict) -> Iterator[str]:
+    separator = "{"
+    for key, item in sorted(value.items()):
+        yield separator
+        yield from _string_chunks(_key_str(key))
+        yield ": "
+        yield from canonical_chunks(item)
+        separator = ", "
+    yield "}" if value else "{}"
+
+
+def _list_chunks(value: list) -> Iterator[str]:
+    separator = "["
+    for item in value:
+        yield separator
+        yield from canonical_chunks(item)
+        separator = ", "
+    yield "]" if value else "[]"
+
+
+def _key_str(key: Any) -> str:
+    # Same conversion json.dumps applies to non-string keys
+    return key if isinstance(key, str) else json.dumps(key)
+
+
+def _legacy_digest(value: Any) -> str:
+    return stream_digest(value, "md5")
+
+
+def _digest(value: Any, algorithm: str) -> bytes:
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return _frozen_digest(value, algorithm)
+    return _mutable_digest(value, algorithm)
+
+
+def _frozen_digest(value: Any, algorithm: str) -> bytes:
+    # Frozen containers never change, so their digest is computed only once
+    digests = getattr(value, "_digests", None)
+    if digests is None:
+        digests = value._digests = {}
+    if algorithm not in digests:
+        digests[algorithm] = _mutable_digest(value, algorithm)
+    return digests[algorithm]
+
+
+def _mutable_digest(value: Any, algorithm: str) -> bytes:
+    if isinstance(value, dict):
+        h = hashlib.new(algorithm, b"d")
+        for key in sorted(value):
+            h.update(_digest(key, algorithm))
+            h.update(_digest(value[key], algorithm))
+        return h.digest()
+    if isinstance(value, (list, tuple)):
+        h = hashlib.new(algorithm, b"l")
+        for item in value:
+            h.update(_digest(item, algorithm))
+        return h.digest()
+    if isinstance(value, str) and len(value) >= BLOB_MIN_SIZE:
+        return _blob_digest(value, algorithm)
+    return _scalar_digest(value, algorithm)
+
+
+def _scalar_digest(value: Any, algorithm: str) -> bytes:
+    h = hashlib.new(algorithm, b"s")
+    for chunk in canonical_chunks(value):
+        h.update(chunk.encode())
+    return h.digest()
+
+
+def _blob_digest(value: str, algorithm: str) -> bytes:
+    global _blob_cache_bytes
+    key = (algorithm, value)
+    digest = _blob_digests.get(key)
+    if digest is not None:
+        _blob_digests.move_to_end(key)
+        return digest
+    digest = _scalar_digest(value, algorithm)
+    if len(value) > BLOB_CACHE_BYTES:
+        return digest
+    _blob_digests[key] = digest
+    _blob_cache_bytes += len(value)
+    while len(_blob_digests) > BLOB_CACHE_SIZE or _blob_cache_bytes > BLOB_CACHE_BYTES:
+        (_, evicted), _ = _blob_digests.popitem(last=False)
+        _blob_cache_bytes -= len(evicted)
+    return digest
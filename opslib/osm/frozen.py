@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# For those usages not covered by the Apache License, Version 2.0 please
+# contact: legal@canonical.com
+#
+# To get in touch with the maintainers, please contact:
+# osm-charmers@lists.launchpad.net
+##
+
+__all__ = ["FrozenDict", "FrozenList", "freeze", "thaw"]
+
+
+from typing import Any
+
+import yaml
+
+
+class _Frozen:
+    """
+    Deeply immutable container
+
+    Frozen containers are still dict and list instances, so they compare
+    equal to the mutable ones and can be serialized as JSON. Since their
+    content never changes, they can be shared between snapshots and their
+    digests cached.
+    """
+
+    __slots__ = ()
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError(
+            f"{type(self).__name__} is immutable, use thaw() to get a mutable copy"
+        )
+
+    def __copy__(self):
+        return thaw(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return freeze, (thaw(self),)
+
+
+class FrozenDict(_Frozen, dict):
+    __slots__ = ("_digests",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(
+            (key, freeze(value)) for key, value in dict(*args, **kwargs).items()
+        )
+
+    __setitem__ = __delitem__ = _Frozen._immutable
+    clear = pop = popitem = setdefault = update = _Frozen._immutable
+    __ior__ = _Frozen._immutable
+
+
+class FrozenList(_Frozen, list):
+    __slots__ = ("_digests",)
+
+    def __init__(self, iterable=()):
+        super().__init__(freeze(value) for value in iterable)
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _Frozen._immutable
+    append = extend = insert = pop = remove = _Frozen._immutable
+    clear = sort = reverse = _Frozen._immutable
+
+
+def freeze(value: Any) -> Any:
+    """
+    Deeply immutable version of a JSON-like value
+
+    Already frozen containers are returned as they are, so freezing a
+    structure that contains snapshots shares them instead of copying them.
+    """
+    if isinstance(value, _Frozen):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict(value)
+    if isinstance(value, (list, tuple)):
+        return FrozenList(value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Mutable deep copy of a JSON-like value, made of plain dicts and lists"""
+    if isinstance(value, dict):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
+
+
+def _register_yaml_representers():
+    # Representers are looked up by exact type, so frozen containers must be
+    # registered for them to be dumped as plain mappings and sequences, e.g.
+    # by ops when setting the pod spec.
+    for name in ("SafeDumper", "Dumper", "CSafeDumper", "CDumper"):
+        dumper = getattr(yaml, name, None)
+        if dumper is None:
+            continue
+        yaml.add_representer(FrozenDict, yaml.SafeDumper.represent_dict, Dumper=dumper)
+        yaml.add_representer(FrozenList, yaml.SafeDumper.represent_list, Dumper=dumper)
+
+
+_register_yaml_representers()
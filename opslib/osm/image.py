@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# For those usages not covered by the Apache License, Version 2.0 please
+# contact: legal@canonical.com
+#
+# To get in touch with the maintainers, please contact:
+# osm-charmers@lists.launchpad.net
+##
+
+__all__ = ["CachedImageResource"]
+
+
+import logging
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from oci_image import OCIImageResource, OCIImageResourceError
+import ops.charm
+from ops.framework import Object, StoredState
+from ops.model import ModelError
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# Seconds during which a failed fetch is not retried
+ERROR_RETRY_INTERVAL = 60
+
+
+class CachedImageResource(Object):
+    """
+    OCI image resource, fetched with resource-get once per resource file
+
+    The image information is kept in memory for the rest of the hook. Only
+    the path, mtime and size of the resource file are kept in the StoredState,
+    never the registry credentials. While the file is unchanged, later hooks
+    read it directly instead of running resource-get again.
+
+    Failed fetches are not retried during error_retry_interval seconds.
+    Attaching a new resource triggers the upgrade-charm hook, which clears
+    the cache and the error.
+
+    :param: charm: Charm using the resource
+    :param: resource_name: Name of the OCI image resource
+    :param: error_retry_interval: Seconds during which a failed fetch is not retried
+    """
+
+    _stored = StoredState()
+
+    def __init__(
+        self,
+        charm: ops.charm.CharmBase,
+        resource_name: str,
+        error_retry_interval: float = ERROR_RETRY_INTERVAL,
+    ):
+        super().__init__(charm, f"cached-image-{resource_name}")
+        self.resource_name = resource_name
+        self.error_retry_interval = error_retry_interval
+        self.resource = OCIImageResource(charm, resource_name)
+        self._image_info = None
+        self._stored.set_default(path=None, stat=None, error_time=None)
+        self.framework.observe(charm.on.upgrade_charm, self.invalidate)
+
+    def fetch(self) -> Dict[str, str]:
+        """
+        Image information: imagePath, username and password
+
+        :raises: OCIImageResourceError if the resource cannot be fetched
+        :return: Dictionary with the image information
+        """
+        if self._stored.error_time is not None:
+            if time.time() - self._stored.error_time < self.error_retry_interval:
+                raise OCIImageResourceError(self.resource_name)
+        if self._image_info is None and self._stored.stat:
+            if _stat(self._stored.path) == tuple(self._stored.stat):
+                self._image_info = _read_image_info(self._stored.path)
+        if self._image_info is not None:
+            return dict(self._image_info)
+        try:
+            image_info = self.resource.fetch()
+        except OCIImageResourceError:
+            self._stored.error_time = time.time()
+            raise
+        self._image_info = dict(image_info)
+        self._stored.error_time = None
+        self._stored.path = self._resource_path()
+        stat = _stat(self._stored.path)
+        self._stored.stat = list(stat) if stat else None
+        return dict(image_info)
+
+    def invalidate(self, _=None):
+        """Forget the cached image information and the last error"""
+        self._image_info = None
+        self._stored.path = self._stored.stat = None
+        self._stored.error_time = None
+
+    def _resource_path(self) -> Optional[str]:
+        # The path is cached by the model, so resource-get is not run again
+        try:
+            return str(self.model.resources.fetch(self.resource_name))
+        except (ModelError, NameError, RuntimeError) as e:
+            logger.debug(f"Image resource file unknown, not caching it: {e}")
+            return None
+
+
+def _read_image_info(path: str) -> Optional[Dict[str, str]]:
+    # Same format OCIImageResource parses. On any problem, None makes fetch()
+    # fall back to the resource, which reports the error.
+    try:
+        with open(path) as f:
+            resource_data = yaml.safe_load(f)
+        return {
+            "imagePath": resource_data["registrypath"],
+            "username": resource_data.get("username", ""),
+            "password": resource_data.get("password", ""),
+        }
+    except (OSError, yaml.YAMLError, TypeError, KeyError, AttributeError) as e:
+        logger.debug(f"Cannot read the image resource file {path}: {e}")
+        return None
+
+
+def _stat(path: Optional[str]) -> Optional[Tuple[int, int]]:
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
@@ -1,10 +1,358 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import inspect
+import json
+import logging
+import math
+import time
+from typing import Any, Dict, List, Mapping, MutableMapping, NamedTuple, Optional, Tuple
+import zlib
+
 import ops.charm
 import ops.framework
+import ops.model
+
+from ..digest import canonical_chunks, stream_digest
+from ..validator import ModelValidator, validate_model
+
+logger = logging.getLogger(__name__)
+
+_TRUE_VALUES = {"true", "yes", "1"}
+_FALSE_VALUES = {"false", "no", "0"}
+
+STRUCTURED_DATA_VERSION = "v1"
+# Maximum size of each relation data value of a structured entry
+STRUCTURED_CHUNK_SIZE = 16 * 1024
+
+
+def update_relation_data(
+    relation_data: MutableMapping[str, str], data: Dict[str, Any]
+) -> Dict[str, str]:
+    """
+    Write only the keys whose value changed
+
+    ops runs one relation-set per key written, so unchanged keys cost no
+    hook tool call, and an update without changes does not wake up the
+    consumers of the relation.
+
+    :param: relation_data: Relation data bag to write
+    :param: data: Keys and values to publish. Values are converted to strings.
+
+    :return: Dictionary with the keys and values actually written
+    """
+    changes = {
+        key: str(value)
+        for key, value in data.items()
+        if relation_data.get(key) != str(value)
+    }
+    if changes:
+        relation_data.update(changes)
+    return changes
+
+
+def rendezvous_score(key: str, member: str, weight: float = 1) -> float:
+    """
+    Weighted rendezvous hashing score of a member for a consumer
+
+    The member with the highest score is the consumer's choice. Each consumer
+    gets a stable choice, members are chosen in proportion to their weights,
+    and removing a member only moves the consumers that had chosen it.
+
+    :param: key: Consumer key, e.g. its unit name
+    :param: member: Stable identifier of the member, e.g. its unit name or address
+    :param: weight: Relative weight of the member. It must be positive.
+
+    :return: Score of the member
+    """
+    digest = hashlib.md5(f"{key}/{member}".encode()).digest()
+    # Uniform value in (0, 1), turned into an exponential draw scaled by the weight
+    uniform = (int.from_bytes(digest[:8], "big") + 1) / (2 ** 64 + 1)
+    return -weight / math.log(uniform)
+
+
+class StructuredData(NamedTuple):
+    digest: Optional[str]
+    value: Any
+    changed: bool
+
+
+def encode_structured_data(
+    key: str, value: Any, chunk_size: int = STRUCTURED_CHUNK_SIZE
+) -> Dict[str, str]:
+    """
+    Encode a JSON-like value as a compressed, versioned and chunked entry
+
+    The entry is made of a header under the key, with the following format:
+    <version>:<digest>:<number of chunks>, and of the base64 encoded zlib
+    compressed JSON document, split in chunks under <key>.0, <key>.1, ...
+
+    :param: key: Key of the entry
+    :param: value: JSON-like value
+    :param: chunk_size: Maximum size of each chunk
+
+    :return: Dictionary with the keys and values of the entry
+    """
+    compressor = zlib.compressobj(9)
+    compressed = b"".join(
+        compressor.compress(chunk.encode()) for chunk in canonical_chunks(value)
+    )
+    encoded = base64.b64encode(compressed + compressor.flush()).decode()
+    chunks = [encoded[i:i + chunk_size] for i in range(0, len(encoded), chunk_size)]
+    entry = {f"{key}.{i}": chunk for i, chunk in enumerate(chunks)}
+    entry[key] = f"{STRUCTURED_DATA_VERSION}:{stream_digest(value)}:{len(chunks)}"
+    return entry
+
+
+def decode_structured_data(
+    data: Dict[str, str], key: str, digest: str = None
+) -> StructuredData:
+    """
+    Decode an entry written by encode_structured_data
+
+    :param: data: Relation data containing the entry
+    :param: key: Key of the entry
+    :param: digest: Digest of the value the reader already has. If the entry
+                    has the same digest, it is not decoded.
+
+    :raises: ValueError if the entry has an unknown version or is corrupted
+    :return: StructuredData. value is None if the entry does not exist, or
+             if it has not changed.
+    """
+    header = data.get(key)
+    if not header:
+        return StructuredData(None, None, digest is not None)
+    version, entry_digest, chunks = _parse_header(key, header)
+    if entry_digest == digest:
+        return StructuredData(digest, None, False)
+    try:
+        encoded = "".join(data[f"{key}.{i}"] for i in range(chunks))
+        value = json.loads(zlib.decompress(base64.b64decode(encoded)).decode())
+    except (KeyError, ValueError, zlib.error) as e:
+        raise ValueError(f"Corrupted structured data in {key}: {e}")
+    if stream_digest(value) != entry_digest:
+        raise ValueError(f"Corrupted structured data in {key}: digest mismatch")
+    return StructuredData(entry_digest, value, True)
+
+
+def update_structured_data(
+    relation_data: MutableMapping[str, str],
+    key: str,
+    value: Any,
+    chunk_size: int = STRUCTURED_CHUNK_SIZE,
+) -> Dict[str, str]:
+    """
+    Write a structured entry, removing the chunks it does not use anymore
+
+    Only the chunks that changed are written, with one relation-set each.
+    The chunks to remove are found with the header of the previous entry.
+    Without a valid header, only the <key>.<number> keys are considered
+    chunks, so other keys starting with <key>. are kept.
+
+    :return: Dictionary with the keys and values actually written
+    """
+    entry = encode_structured_data(key, value, chunk_size)
+    stale = {
+        chunk_key: ""
+        for chunk_key in _chunk_keys(relation_data, key)
+        if chunk_key not in entry
+    }
+    return update_relation_data(relation_data, {**entry, **stale})
+
+
+def _chunk_keys(data: Mapping[str, str], key: str) -> List[str]:
+    try:
+        _, _, chunks = _parse_header(key, data.get(key) or "")
+    except ValueError:
+        prefix = f"{key}."
+        return [
+            data_key
+            for data_key in data.keys()
+            if data_key.startswith(prefix) and data_key[len(prefix):].isdigit()
+        ]
+    return [f"{key}.{i}" for i in range(chunks) if f"{key}.{i}" in data]
+
+
+def _parse_header(key: str, header: str) -> Tuple[str, str, int]:
+    version, _, rest = header.partition(":")
+    if version != STRUCTURED_DATA_VERSION:
+        raise ValueError(f"Unsupported structured data version in {key}: {version}")
+    digest, _, chunks = rest.partition(":")
+    if not digest or not chunks.isdigit():
+        raise ValueError(f"Invalid structured data header in {key}: {header}")
+    return version, digest, int(chunks)
+
+
+class PrefetchReport:
+    """Timings of a relation data prefetch, and the reads that failed"""
+
+    def __init__(
+        self, reads: Dict[str, float], wall_time: float, errors: Optional[Dict[str, str]] = None
+    ):
+        self.reads = reads
+        self.wall_time = wall_time
+        self.errors = errors or {}
+
+    @property
+    def serial_time(self) -> float:
+        """Time the reads would have taken one after the other"""
+        return sum(self.reads.values())
+
+    @property
+    def saved_time(self) -> float:
+        return max(self.serial_time - self.wall_time, 0.0)
+
+    def __str__(self):
+        failed = f", {len(self.errors)} failed" if self.errors else ""
+        return (
+            f"{len(self.reads)} relation data reads in {self.wall_time:.3f}s "
+            f"({self.serial_time:.3f}s serial, {self.saved_time:.3f}s saved{failed})"
+        )
+
+
+def prefetch_relation_data(model: ops.model.Model, max_workers: int = 4) -> PrefetchReport:
+    """
+    Load the data of every remote application and unit, concurrently
+
+    The model caches the data it loads, so later reads during the same hook,
+    like the ones of the relation clients, cost no relation-get. A failed read
+    is logged and recorded in the report; the data bag is then loaded, and the
+    error raised, by the first read of the hook that needs it.
+
+    :param: model: Charm model
+    :param: max_workers: Maximum number of concurrent relation-get calls
+
+    :return: PrefetchReport with the duration of each read and the failed ones
+    """
+    data_bags = []
+    for relations in model.relations.values():
+        for relation in relations:
+            entities = [relation.app] if relation.app else []
+            entities.extend(sorted(relation.units, key=lambda unit: unit.name))
+            data_bags.extend((relation, entity) for entity in entities)
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(_timed_read, data_bags))
+    reads = {name: duration for name, duration, _ in results}
+    errors = {name: error for name, _, error in results if error}
+    return PrefetchReport(reads, time.monotonic() - start, errors)
+
+
+def _timed_read(data_bag):
+    relation, entity = data_bag
+    name = f"{relation.name}:{relation.id}/{entity.name}"
+    start = time.monotonic()
+    error = None
+    try:
+        dict(relation.data[entity])
+    except ops.model.ModelError as e:
+        # Left unloaded, the next read of the data bag tries again
+        logger.warning(f"Relation data prefetch of {name} failed: {e}")
+        error = str(e)
+    return name, time.monotonic() - start, error
+
+
+class BaseRelationServer(ops.framework.Object):
+    """Provides side of an Endpoint publishing application data"""
+
+    def __init__(self, charm: ops.charm.CharmBase, relation_name: str):
+        super().__init__(charm, relation_name)
+        self.relation_name = relation_name
+
+    def publish_app_data(self, data: Dict[str, Any]):
+        """
+        Publish the application data in every relation, if this unit is the leader
+
+        :param: data: Keys and values to publish. Values are converted to strings.
+        """
+        if self.framework.model.unit.is_leader():
+            for relation in self.framework.model.relations[self.relation_name]:
+                update_relation_data(relation.data[self.framework.model.app], data)
+
+    def publish_unit_data(self, data: Dict[str, Any]):
+        """
+        Publish the data of this unit in every relation
+
+        :param: data: Keys and values to publish. Values are converted to strings.
+        """
+        for relation in self.framework.model.relations[self.relation_name]:
+            update_relation_data(relation.data[self.framework.model.unit], data)
+
+    def publish_app_structured_data(self, key: str, value: Any):
+        """
+        Publish a structured entry in every relation, if this unit is the leader
+
+        :param: key: Key of the entry
+        :param: value: JSON-like value, see encode_structured_data
+        """
+        if self.framework.model.unit.is_leader():
+            for relation in self.framework.model.relations[self.relation_name]:
+                update_structured_data(relation.data[self.framework.model.app], key, value)
+
+    def publish_unit_structured_data(self, key: str, value: Any):
+        """
+        Publish a structured entry of this unit in every relation
+
+        :param: key: Key of the entry
+        :param: value: JSON-like value, see encode_structured_data
+        """
+        for relation in self.framework.model.relations[self.relation_name]:
+            update_structured_data(relation.data[self.framework.model.unit], key, value)
+
+
+class RelationSnapshot:
+    """
+    Data of the remote application and units of a relation
+
+    The application and the units data bags are read the first time they
+    are used, and then kept for the rest of the snapshot, so clients reading
+    only one of them do not run relation-get for the other.
+    """
+
+    def __init__(self, relation: ops.model.Relation):
+        self.relation = relation
+        self._app_data = None
+        self._units_data = None
+        self.payload = None
+        # Views derived from the data (e.g. endpoint indexes), cached by name
+        self.views = {}
+
+    @property
+    def app_data(self) -> Dict[str, str]:
+        if self._app_data is None:
+            relation = self.relation
+            self._app_data = {}
+            if relation.app and relation.app in relation.data:
+                self._app_data = dict(relation.data[relation.app])
+        return self._app_data
+
+    @property
+    def units_data(self) -> Dict[str, Dict[str, str]]:
+        if self._units_data is None:
+            self._units_data = {
+                unit.name: dict(self.relation.data[unit])
+                for unit in sorted(self.relation.units, key=lambda unit: unit.name)
+            }
+        return self._units_data
+
+    def get_from_unit(self, key: str):
+        for data in self.units_data.values():
+            if data.get(key):
+                return data[key]
+
+    def get_from_app(self, key: str):
+        return self.app_data.get(key) or None
 
 
 class BaseRelationClient(ops.framework.Object):
     """Requires side of a Kafka Endpoint"""
 
+    # ModelValidator describing the data of the relation, where it is read from,
+    # and the optional Payload class in which it is returned
+    schema = None
+    payload_source = "app"
+    payload_class = None
+
     def __init__(
         self,
         charm: ops.charm.CharmBase,
@@ -14,32 +362,115 @@ class BaseRelationClient(ops.framework.Object):
         super().__init__(charm, relation_name)
         self.relation_name = relation_name
         self.mandatory_fields = mandatory_fields
+        self._snapshot = None
         self._update_relation()
+        # The remote data does not change during a hook: the snapshot lives until
+        # the framework commits, or until an event of this relation is received.
+        relation_events = charm.on[relation_name]
+        for event in (
+            relation_events.relation_joined,
+            relation_events.relation_changed,
+            relation_events.relation_departed,
+            relation_events.relation_broken,
+        ):
+            self.framework.observe(event, self._on_relation_event)
+        self.framework.observe(self.framework.on.commit, self._invalidate_snapshot)
+
+    @property
+    def snapshot(self) -> RelationSnapshot:
+        """
+        Data of the relation, read once per hook
+
+        :return: RelationSnapshot, or None if the relation does not exist
+        """
+        if self._snapshot is None:
+            if not self.relation:
+                # This update relation doesn't seem to be needed, but I added it because
+                # apparently the data is empty in the unit tests.
+                # In reality, the constructor is called in every hook.
+                self._update_relation()
+            if self.relation:
+                self._snapshot = RelationSnapshot(self.relation)
+        return self._snapshot
 
     def get_data_from_unit(self, key: str):
-        if not self.relation:
-            # This update relation doesn't seem to be needed, but I added it because apparently
-            # the data is empty in the unit tests.
-            # In reality, the constructor is called in every hook.
-            # In the unit tests when doing an update_relation_data, apparently it is not called.
-            self._update_relation()
-        if self.relation:
-            for unit in self.relation.units:
-                data = self.relation.data[unit].get(key)
-                if data:
-                    return data
+        if self.snapshot:
+            return self.snapshot.get_from_unit(key)
 
     def get_data_from_app(self, key: str):
-        if not self.relation or self.relation.app not in self.relation.data:
-            # This update relation doesn't seem to be needed, but I added it because apparently
-            # the data is empty in the unit tests.
-            # In reality, the constructor is called in every hook.
-            # In the unit tests when doing an update_relation_data, apparently it is not called.
-            self._update_relation()
-        if self.relation and self.relation.app in self.relation.data:
-            data = self.relation.data[self.relation.app].get(key)
-            if data:
-                return data
+        if self.snapshot:
+            return self.snapshot.get_from_app(key)
+
+    def get_data(self, key: str):
+        """Value of a key, read from the remote app or units depending on the client"""
+        if self.payload_source == "unit":
+            return self.get_data_from_unit(key)
+        return self.get_data_from_app(key)
+
+    def get_payload(self):
+        """
+        Relation data parsed and validated with the schema of the client
+
+        Values are converted from strings to the types of the schema. The
+        payload is computed once per hook.
+
+        :raises: ValidationError with every missing or invalid field
+        :return: Instance of the payload class of the client, or of its schema
+                 if it has none. None if the relation does not exist.
+        """
+        if not self.snapshot:
+            return None
+        if self.snapshot.payload is None:
+            data = {
+                attr_name: _coerce(self.get_data(attr_name), type_to_check)
+                for attr_name, _, type_to_check, _ in self.schema.__validation_plan__
+            }
+            if self.payload_class:
+                values, validation_error = validate_model(self.schema, data)
+                if validation_error:
+                    raise validation_error
+                self.snapshot.payload = self.payload_class(values)
+            else:
+                self.snapshot.payload = self.schema(**data)
+        return self.snapshot.payload
+
+    def get_structured_data(self, key: str, digest: str = None) -> StructuredData:
+        """
+        Structured entry published by the remote app or units
+
+        Unit sourced entries are read from the first unit that publishes them.
+
+        :param: key: Key of the entry
+        :param: digest: Digest of the value the caller already has (e.g. kept
+                        in its StoredState). If it has not changed, the entry
+                        is not decoded.
+
+        :raises: ValueError if the entry is corrupted
+        :return: StructuredData
+        """
+        data = {}
+        if self.snapshot and self.payload_source == "unit":
+            data = next(
+                (d for d in self.snapshot.units_data.values() if d.get(key)), {}
+            )
+        elif self.snapshot:
+            data = self.snapshot.app_data
+        return decode_structured_data(data, key, digest)
+
+    def get_view(self, name: str, compute):
+        """
+        View derived from the relation data, computed once per snapshot
+
+        :param: name: Name of the view
+        :param: compute: Function computing the view out of the RelationSnapshot
+
+        :return: Computed view, or None if the relation does not exist
+        """
+        if not self.snapshot:
+            return None
+        if name not in self.snapshot.views:
+            self.snapshot.views[name] = compute(self.snapshot)
+        return self.snapshot.views[name]
 
     def is_missing_data_in_unit(self):
         return not all(
@@ -53,3 +484,167 @@ class BaseRelationClient(ops.framework.Object):
 
     def _update_relation(self):
         self.relation = self.framework.model.get_relation(self.relation_name)
+
+    def _invalidate_snapshot(self, _=None):
+        self._snapshot = None
+
+    def _on_relation_event(self, _=None):
+        self._invalidate_snapshot()
+        self._update_relation()
+
+
+def _coerce(value: Any, type_to_check: type) -> Any:
+    # Values that cannot be converted are returned as they are, for the validator
+    # to report them.
+    if not isinstance(value, str) or type_to_check is str:
+        return value
+    if type_to_check is bool:
+        lower = value.lower()
+        return True if lower in _TRUE_VALUES else False if lower in _FALSE_VALUES else value
+    try:
+        if type_to_check in (int, float):
+            return type_to_check(value)
+        if type_to_check in (list, dict, tuple, set):
+            return type_to_check(json.loads(value))
+    except (ValueError, TypeError):
+        pass
+    return value
+
+
+class Payload:
+    """Relation data parsed with the schema of an interface, in slots"""
+
+    __slots__ = ()
+
+    def __init__(self, values: Dict[str, Any]):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+
+class InterfaceDefinition:
+    """
+    Declarative definition of a relation interface
+
+    The schema, the payload class, and the provides (server) and requires
+    (client) classes of the interface are generated out of its fields:
+
+        KAFKA = InterfaceDefinition(
+            "Kafka", [("host", str), ("port", int)], "unit", module=__name__
+        )
+        KafkaClient = KAFKA.client_class
+
+    Fields typed as Optional are not mandatory.
+
+    :param: name: Name of the interface, used as prefix of the generated classes
+    :param: fields: List of (name, type) tuples
+    :param: source: "app" if the data is published in the application data bag,
+                    "unit" if it is published in the units data bags
+    :param: module: Module the generated classes belong to, usually __name__
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fields: List[Tuple[str, type]],
+        source: str = "app",
+        module: str = __name__,
+    ):
+        if source not in ("app", "unit"):
+            raise ValueError(f"Invalid source: {source}")
+        self.name = name
+        self.fields = fields
+        self.source = source
+        self.schema = type(
+            f"{name}Data",
+            (ModelValidator,),
+            {"__annotations__": dict(fields), "__module__": module},
+        )
+        self.payload_class = type(
+            f"{name}Payload",
+            (Payload,),
+            {"__slots__": tuple(field for field, _ in fields), "__module__": module},
+        )
+        self.client_class = self._client_class(module)
+        self.server_class = self._server_class(module)
+
+    @property
+    def mandatory_fields(self) -> List[str]:
+        return [
+            attr_name
+            for attr_name, optional, _, _ in self.schema.__validation_plan__
+            if not optional
+        ]
+
+    def _client_class(self, module: str) -> type:
+        mandatory_fields = self.mandatory_fields
+
+        def __init__(client, charm: ops.charm.CharmBase, relation_name: str):
+            BaseRelationClient.__init__(client, charm, relation_name, mandatory_fields)
+
+        namespace = {
+            "__doc__": f"Requires side of a {self.name} Endpoint",
+            "__module__": module,
+            "__init__": __init__,
+            "mandatory_fields": mandatory_fields,
+            "schema": self.schema,
+            "payload_class": self.payload_class,
+            "payload_source": self.source,
+        }
+        namespace.update({field: _field_property(field) for field, _ in self.fields})
+        return type(f"{self.name}Client", (BaseRelationClient,), namespace)
+
+    def _server_class(self, module: str) -> type:
+        field_names = [field for field, _ in self.fields]
+        signature = self._publish_info_signature()
+        source = self.source
+
+        def publish_info(server, *args, **kwargs):
+            data = signature.bind(server, *args, **kwargs).arguments
+            data = {
+                key: value
+                for key, value in data.items()
+                if key in field_names and value is not None
+            }
+            if source == "unit":
+                server.publish_unit_data(data)
+            else:
+                server.publish_app_data(data)
+
+        publish_info.__doc__ = f"Publish {', '.join(field_names)}"
+        publish_info.__signature__ = signature
+        publish_info.__qualname__ = f"{self.name}Server.publish_info"
+        namespace = {
+            "__doc__": f"Provides side of a {self.name} Endpoint",
+            "__module__": module,
+            "relation_name": None,
+            "publish_info": publish_info,
+        }
+        return type(f"{self.name}Server", (BaseRelationServer,), namespace)
+
+    def _publish_info_signature(self) -> inspect.Signature:
+        # Optional fields default to None. Mandatory fields after an optional
+        # one can only be passed by keyword.
+        mandatory_fields = self.mandatory_fields
+        kind = inspect.Parameter.POSITIONAL_OR_KEYWORD
+        parameters = [inspect.Parameter("self", kind)]
+        for field, field_type in self.fields:
+            default = None if field not in mandatory_fields else inspect.Parameter.empty
+            if default is inspect.Parameter.empty and parameters[-1].default is None:
+                kind = inspect.Parameter.KEYWORD_ONLY
+            parameters.append(
+                inspect.Parameter(field, kind, default=default, annotation=field_type)
+            )
+        return inspect.Signature(parameters)
+
+
+def _field_property(key: str) -> property:
+    return property(lambda client: client.get_data(key), doc=f"{key} of the relation")
@@ -21,42 +21,123 @@ Ported to the Operator Framework from the canonical-osm Reactive
 charms at https://git.launchpad.net/canonical-osm
 """
 
+from typing import List, NamedTuple
+
 import ops.charm
-import ops.framework
-import ops.model
 
-from .common import BaseRelationClient
+from .common import InterfaceDefinition, rendezvous_score
+
+HTTP_INTERFACE = InterfaceDefinition(
+    "Http", [("host", str), ("port", int)], "app", module=__name__
+)
+
+HttpData = HTTP_INTERFACE.schema
 
+DEFAULT_WEIGHT = 1
 
-class HttpServer(ops.framework.Object):
+
+class HttpEndpoint(NamedTuple):
+    unit: str
+    host: str
+    port: int
+    weight: int
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+
+class HttpServer(HTTP_INTERFACE.server_class):
     """Provides side of a Http Endpoint"""
 
-    relation_name: str = None
+    def publish_unit_endpoint(self, host: str, port: int, weight: int = DEFAULT_WEIGHT):
+        """
+        Publish the endpoint of this unit, for client-side load balancing
+
+        :param: host: Address of this unit
+        :param: port: Port of this unit
+        :param: weight: Relative capacity of this unit. 0 drains the unit.
+        """
+        if weight < 0:
+            raise ValueError(f"Invalid weight: {weight}")
+        self.publish_unit_data({"host": host, "port": port, "weight": weight})
+
+
+class HttpClient(HTTP_INTERFACE.client_class):
+    """Requires side of a Http Endpoint"""
 
     def __init__(self, charm: ops.charm.CharmBase, relation_name: str):
         super().__init__(charm, relation_name)
-        self.relation_name = relation_name
+        self._endpoints = None
+        relation_events = charm.on[relation_name]
+        for event in (
+            relation_events.relation_joined,
+            relation_events.relation_departed,
+            relation_events.relation_broken,
+        ):
+            self.framework.observe(event, self._invalidate_endpoints)
 
-    def publish_info(self, host: str, port: int):
-        if self.framework.model.unit.is_leader():
-            for relation in self.framework.model.relations[self.relation_name]:
-                relation_data = relation.data[self.framework.model.app]
-                relation_data["host"] = str(host)
-                relation_data["port"] = str(port)
+    @property
+    def endpoints(self) -> List[HttpEndpoint]:
+        """
+        Weighted endpoints of the server units
 
+        The list is only recomputed when units join or depart the relation.
+        Units with weight 0 are left out. Servers that do not publish unit
+        endpoints are seen as a single endpoint with the application host
+        and port.
 
-class HttpClient(BaseRelationClient):
-    """Requires side of a Http Endpoint"""
+        :return: List of HttpEndpoint, sorted by unit name
+        """
+        units = self._unit_names()
+        if self._endpoints is None or self._endpoints[0] != units:
+            self._endpoints = (units, self._compute_endpoints())
+        return self._endpoints[1]
 
-    mandatory_fields = ["host", "port"]
+    def pick_endpoint(self, key: str = None) -> HttpEndpoint:
+        """
+        Endpoint for a consumer, chosen in proportion to the weights
 
-    def __init__(self, charm: ops.charm.CharmBase, relation_name: str):
-        super().__init__(charm, relation_name, self.mandatory_fields)
+        The choice is deterministic (weighted rendezvous hashing), and only
+        the consumers of a departing unit move to other endpoints.
 
-    @property
-    def host(self):
-        return self.get_data_from_app("host")
+        :param: key: Consumer key. Defaults to the unit name.
 
-    @property
-    def port(self):
-        return self.get_data_from_app("port")
+        :return: HttpEndpoint, or None if there are no endpoints
+        """
+        key = key or self.framework.model.unit.name
+        return max(
+            self.endpoints,
+            key=lambda endpoint: rendezvous_score(key, endpoint.unit, endpoint.weight),
+            default=None,
+        )
+
+    def _unit_names(self) -> tuple:
+        if not self.relation:
+            self._update_relation()
+        if not self.relation:
+            return ()
+        return tuple(sorted(unit.name for unit in self.relation.units))
+
+    def _compute_endpoints(self) -> List[HttpEndpoint]:
+        if not self.snapshot:
+            return []
+        endpoints = [
+            HttpEndpoint(unit, data["host"], int(data["port"]), _weight(data))
+            for unit, data in self.snapshot.units_data.items()
+            if data.get("host") and str(data.get("port", "")).isdigit()
+        ]
+        if not endpoints and self.host and self.port:
+            app = self.relation.app.name if self.relation.app else ""
+            endpoints = [HttpEndpoint(app, self.host, int(self.port), DEFAULT_WEIGHT)]
+        return [endpoint for endpoint in endpoints if endpoint.weight > 0]
+
+    def _invalidate_endpoints(self, _=None):
+        self._endpoints = None
+
+
+def _weight(data: dict) -> int:
+    try:
+        return max(int(data.get("weight", DEFAULT_WEIGHT)), 0)
+    except ValueError:
+        return DEFAULT_WEIGHT
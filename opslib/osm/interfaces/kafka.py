@@ -1,20 +1,72 @@
-import ops.charm
+import random
+from typing import Dict, List
 
-from .common import BaseRelationClient
+from .common import InterfaceDefinition, RelationSnapshot, rendezvous_score
 
+KAFKA_INTERFACE = InterfaceDefinition(
+    "Kafka", [("host", str), ("port", int)], "unit", module=__name__
+)
 
-class KafkaClient(BaseRelationClient):
-    """Requires side of a Kafka Endpoint"""
+KafkaData = KAFKA_INTERFACE.schema
+KafkaServer = KAFKA_INTERFACE.server_class
 
-    mandatory_fields = ["host", "port"]
 
-    def __init__(self, charm: ops.charm.CharmBase, relation_name: str):
-        super().__init__(charm, relation_name, self.mandatory_fields)
+class BrokerOrder:
+    # Sorted by unit name: every consumer gets the same list
+    SORTED = "sorted"
+    # Shuffled with the consumer as seed: stable for a consumer, different across them
+    SHUFFLE = "shuffle"
+    # Rendezvous hashing: like SHUFFLE, but adding or removing a broker only
+    # moves the consumers that had it first
+    HASH = "hash"
 
-    @property
-    def host(self):
-        return self.get_data_from_unit("host")
+
+class KafkaClient(KAFKA_INTERFACE.client_class):
+    """Requires side of a Kafka Endpoint"""
 
     @property
-    def port(self):
-        return self.get_data_from_unit("port")
+    def broker_index(self) -> Dict[str, str]:
+        """
+        Endpoint of every broker unit
+
+        The index is built once from the relation snapshot, and rebuilt only
+        after an event of the relation (units joining, changing or departing).
+
+        :return: Dictionary with unit names as keys, and host:port as values
+        """
+        return self.get_view("broker_index", _broker_index) or {}
+
+    def brokers(self, order: str = BrokerOrder.SORTED, key: str = None) -> List[str]:
+        """
+        Endpoints of all the brokers
+
+        :param: order: One of the BrokerOrder values
+        :param: key: Consumer key for SHUFFLE and HASH. Defaults to the unit name.
+
+        :return: List of host:port strings
+        """
+        brokers = [self.broker_index[unit] for unit in sorted(self.broker_index)]
+        key = key or self.framework.model.unit.name
+        if order == BrokerOrder.SHUFFLE:
+            random.Random(key).shuffle(brokers)
+        elif order == BrokerOrder.HASH:
+            brokers.sort(key=lambda broker: rendezvous_score(key, broker), reverse=True)
+        elif order != BrokerOrder.SORTED:
+            raise ValueError(f"Invalid broker order: {order}")
+        return brokers
+
+    def bootstrap_servers(self, order: str = BrokerOrder.SORTED, key: str = None) -> str:
+        """
+        Bootstrap servers string for Kafka clients
+
+        :return: String with the following format: <host>:<port>,<host>:<port>,...
+        """
+        return ",".join(self.brokers(order, key))
+
+
+def _broker_index(snapshot: RelationSnapshot) -> Dict[str, str]:
+    return {
+        unit: f"{data['host']}:{data['port']}"
+        for unit, data in snapshot.units_data.items()
+        if data.get("host") and data.get("port")
+    }
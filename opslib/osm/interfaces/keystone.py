@@ -21,119 +21,28 @@ Ported to the Operator Framework from the canonical-osm Reactive
 charms at https://git.launchpad.net/canonical-osm
 """
 
-import ops.charm
-import ops.framework
-import ops.model
-
-from .common import BaseRelationClient
-
-
-class KeystoneServer(ops.framework.Object):
-    """Provides side of a Keystone Endpoint"""
-
-    relation_name: str = None
-
-    def __init__(self, charm: ops.charm.CharmBase, relation_name: str):
-        super().__init__(charm, relation_name)
-        self.relation_name = relation_name
-
-    def publish_info(
-        self,
-        host: str,
-        port: int,
-        user_domain_name: str,
-        project_domain_name: str,
-        username: str,
-        password: str,
-        service: str,
-        keystone_db_password: str,
-        region_id: str,
-        admin_username: str,
-        admin_password: str,
-        admin_project_name: str,
-    ):
-        if self.framework.model.unit.is_leader():
-            for relation in self.framework.model.relations[self.relation_name]:
-                relation_data = relation.data[self.framework.model.app]
-                relation_data["host"] = str(host)
-                relation_data["port"] = str(port)
-                relation_data["user_domain_name"] = str(user_domain_name)
-                relation_data["project_domain_name"] = str(project_domain_name)
-                relation_data["username"] = str(username)
-                relation_data["password"] = str(password)
-                relation_data["service"] = str(service)
-                relation_data["keystone_db_password"] = str(keystone_db_password)
-                relation_data["region_id"] = str(region_id)
-                relation_data["admin_username"] = str(admin_username)
-                relation_data["admin_password"] = str(admin_password)
-                relation_data["admin_project_name"] = str(admin_project_name)
-
-
-class KeystoneClient(BaseRelationClient):
-    """Requires side of a Keystone Endpoint"""
-
-    mandatory_fields = [
-        "host",
-        "port",
-        "user_domain_name",
-        "project_domain_name",
-        "username",
-        "password",
-        "service",
-        "keystone_db_password",
-        "region_id",
-        "admin_username",
-        "admin_password",
-        "admin_project_name",
-    ]
-
-    def __init__(self, charm: ops.charm.CharmBase, relation_name: str):
-        super().__init__(charm, relation_name, self.mandatory_fields)
-
-    @property
-    def host(self):
-        return self.get_data_from_app("host")
-
-    @property
-    def port(self):
-        return self.get_data_from_app("port")
-
-    @property
-    def user_domain_name(self):
-        return self.get_data_from_app("user_domain_name")
-
-    @property
-    def project_domain_name(self):
-        return self.get_data_from_app("project_domain_name")
-
-    @property
-    def username(self):
-        return self.get_data_from_app("username")
-
-    @property
-    def password(self):
-        return self.get_data_from_app("password")
-
-    @property
-    def service(self):
-        return self.get_data_from_app("service")
-
-    @property
-    def keystone_db_password(self):
-        return self.get_data_from_app("keystone_db_password")
-
-    @property
-    def region_id(self):
-        return self.get_data_from_app("region_id")
-
-    @property
-    def admin_username(self):
-        return self.get_data_from_app("admin_username")
-
-    @property
-    def admin_password(self):
-        return self.get_data_from_app("admin_password")
-
-    @property
-    def admin_project_name(self):
-        return self.get_data_from_app("admin_project_name")
+from .common import InterfaceDefinition
+
+KEYSTONE_INTERFACE = InterfaceDefinition(
+    "Keystone",
+    [
+        ("host", str),
+        ("port", int),
+        ("user_domain_name", str),
+        ("project_domain_name", str),
+        ("username", str),
+        ("password", str),
+        ("service", str),
+        ("keystone_db_password", str),
+        ("region_id", str),
+        ("admin_username", str),
+        ("admin_password", str),
+        ("admin_project_name", str),
+    ],
+    "app",
+    module=__name__,
+)
+
+KeystoneData = KEYSTONE_INTERFACE.schema
+KeystoneServer = KEYSTONE_INTERFACE.server_class
+KeystoneClient = KEYSTONE_INTERFACE.client_class
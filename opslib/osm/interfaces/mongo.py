@@ -1,16 +1,111 @@
-import ops.charm
+from typing import Any, Dict, List
+from urllib.parse import parse_qsl, urlencode, urlsplit
 
-from .common import BaseRelationClient
+from .common import InterfaceDefinition, RelationSnapshot
 
+MONGO_INTERFACE = InterfaceDefinition(
+    "Mongo", [("connection_string", str)], "unit", module=__name__
+)
+
+MongoData = MONGO_INTERFACE.schema
+MongoServer = MONGO_INTERFACE.server_class
+
+# Keyword arguments of MongoClient.get_uri, and their connection string option
+URI_OPTIONS = {
+    "replica_set": "replicaSet",
+    "max_pool_size": "maxPoolSize",
+    "min_pool_size": "minPoolSize",
+    "max_idle_time_ms": "maxIdleTimeMS",
+    "read_preference": "readPreference",
+    "w": "w",
+    "wtimeout_ms": "wtimeoutMS",
+    "connect_timeout_ms": "connectTimeoutMS",
+    "socket_timeout_ms": "socketTimeoutMS",
+    "server_selection_timeout_ms": "serverSelectionTimeoutMS",
+}
 
-class MongoClient(BaseRelationClient):
-    """Requires side of a Mongo Endpoint"""
 
-    mandatory_fields = ["connection_string"]
+class MongoReplicaSet:
+    """Members and options of a replica set, aggregated from all units"""
 
-    def __init__(self, charm: ops.charm.CharmBase, relation_name: str):
-        super().__init__(charm, relation_name, self.mandatory_fields)
+    def __init__(self, connection_strings: List[str]):
+        self.members = []
+        self.credentials = None
+        self.database = ""
+        self.options = {}
+        for connection_string in connection_strings:
+            self._add(connection_string)
+
+    def __bool__(self):
+        return bool(self.members)
 
     @property
-    def connection_string(self):
-        return self.get_data_from_unit("connection_string")
+    def name(self) -> str:
+        return self.options.get("replicaSet")
+
+    def _add(self, connection_string: str):
+        uri = urlsplit(connection_string)
+        credentials, _, hosts = uri.netloc.rpartition("@")
+        for member in hosts.split(","):
+            if member and member not in self.members:
+                self.members.append(member)
+        self.credentials = self.credentials or credentials or None
+        self.database = self.database or uri.path.lstrip("/")
+        for key, value in parse_qsl(uri.query):
+            self.options.setdefault(key, value)
+
+    def uri(self, options: Dict[str, Any] = None) -> str:
+        options = {**self.options, **(options or {})}
+        credentials = f"{self.credentials}@" if self.credentials else ""
+        uri = f"mongodb://{credentials}{','.join(self.members)}/{self.database}"
+        if options:
+            uri += "?" + urlencode(sorted((k, str(v)) for k, v in options.items()))
+        return uri
+
+
+class MongoClient(MONGO_INTERFACE.client_class):
+    """Requires side of a Mongo Endpoint"""
+
+    @property
+    def replica_set(self) -> MongoReplicaSet:
+        """Replica set described by the connection strings of all the units"""
+        return self.get_view("replica_set", _replica_set)
+
+    def get_uri(self, **options) -> str:
+        """
+        Connection string with all the members of the replica set
+
+        Options are the keyword arguments in URI_OPTIONS, or connection string
+        options in their own spelling. None values are ignored, so charm
+        config values can be passed directly. Example:
+
+            container_builder.add_env(
+                "OSMNBI_DATABASE_URI",
+                self.mongodb_client.get_uri(
+                    max_pool_size=self.config.get("mongodb_max_pool_size"),
+                    read_preference="secondaryPreferred",
+                ),
+            )
+
+        :return: String with the following format:
+                    mongodb://<members>/<database>?<options>
+        """
+        if not self.replica_set:
+            return None
+        return self.replica_set.uri(
+            {
+                URI_OPTIONS.get(key, key): value
+                for key, value in options.items()
+                if value is not None
+            }
+        )
+
+
+def _replica_set(snapshot: RelationSnapshot) -> MongoReplicaSet:
+    return MongoReplicaSet(
+        [
+            data["connection_string"]
+            for data in snapshot.units_data.values()
+            if data.get("connection_string")
+        ]
+    )
@@ -1,69 +1,134 @@
-import ops.charm
-
-from .common import BaseRelationClient
-
-
-class MysqlClient(BaseRelationClient):
+from typing import Dict, List
+from urllib.parse import urlencode
+
+from .common import InterfaceDefinition, RelationSnapshot, rendezvous_score
+
+MYSQL_INTERFACE = InterfaceDefinition(
+    "Mysql",
+    [
+        ("host", str),
+        ("port", int),
+        ("user", str),
+        ("password", str),
+        ("root_password", str),
+        ("database", str),
+    ],
+    "unit",
+    module=__name__,
+)
+
+MysqlData = MYSQL_INTERFACE.schema
+MysqlServer = MYSQL_INTERFACE.server_class
+
+
+class MysqlClient(MYSQL_INTERFACE.client_class):
     """Requires side of a Mysql Endpoint"""
 
-    mandatory_fields = ["host", "port", "user", "password", "root_password", "database"]
-
-    def __init__(self, charm: ops.charm.CharmBase, relation_name: str):
-        super().__init__(charm, relation_name, self.mandatory_fields)
-
-    @property
-    def host(self):
-        return self.get_data_from_unit("host")
-
     @property
-    def port(self):
-        return self.get_data_from_unit("port")
+    def endpoints(self) -> Dict[str, str]:
+        """
+        Endpoint published by every unit
 
-    @property
-    def user(self):
-        return self.get_data_from_unit("user")
+        :return: Dictionary with unit names as keys, and host:port as values
+        """
+        return self.get_view("endpoints", _endpoints) or {}
 
     @property
-    def password(self):
-        return self.get_data_from_unit("password")
+    def read_endpoints(self) -> List[str]:
+        """
+        Endpoints to send reads to
 
-    @property
-    def root_password(self):
-        return self.get_data_from_unit("root_password")
+        The relation does not say which unit is the primary. The one publishing
+        the host and port of the relation, which is the first unit by name, is
+        assumed to take the writes, and the other units to be read replicas.
 
-    @property
-    def database(self):
-        return self.get_data_from_unit("database")
+        :return: The endpoints of all units other than the one of host and port,
+                 or just that one if there are no replicas
+        """
+        write_endpoint = f"{self.host}:{self.port}"
+        replicas = sorted(set(self.endpoints.values()) - {write_endpoint})
+        return replicas or [write_endpoint]
 
-    def get_root_uri(self, database: str):
+    def get_root_uri(self, database: str, **options):
         """
         Get the URI for the mysql connection with the root user credentials
 
         :param: database: Database name
+        :param: options: Connection options (e.g. connect_timeout, read_timeout,
+                         charset). None values are ignored.
 
         :return: A string with the following format:
                     mysql://root:<root_password>@<mysql_host>:<mysql_port>/<database>
         """
-        return "mysql://root:{}@{}:{}/{}".format(
+        return "mysql://root:{}@{}:{}/{}{}".format(
             self.root_password,
             self.host,
             self.port,
-            database
+            database,
+            _query(options),
         )
 
-    def get_uri(self):
+    def get_uri(self, **options):
         """
         Get the URI for the mysql connection with the standard user credentials
 
-        :param: database: Database name
+        :param: options: Connection options (e.g. connect_timeout, read_timeout,
+                         charset). None values are ignored.
 
         :return: A string with the following format:
                     mysql://<user>:<password>@<mysql_host>:<mysql_port>/<database>
         """
-        return "mysql://{}:{}@{}:{}/{}".format(
+        return "mysql://{}:{}@{}:{}/{}{}".format(
             self.user,
             self.password,
             self.host,
             self.port,
-            self.database
+            self.database,
+            _query(options),
+        )
+
+    def get_read_uris(self, **options) -> List[str]:
+        """
+        Get the URIs of all the read endpoints, with the standard user credentials
+
+        :param: options: Connection options. None values are ignored.
+
+        :return: A list of strings with the following format:
+                    mysql://<user>:<password>@<replica_host>:<replica_port>/<database>
+        """
+        return [self._read_uri(endpoint, options) for endpoint in self.read_endpoints]
+
+    def get_read_uri(self, key: str = None, **options) -> str:
+        """
+        Get the URI of one read endpoint, always the same for a given consumer
+
+        The endpoint is chosen with rendezvous hashing on the consumer key and
+        the endpoint only, so changing the options or the credentials does not
+        move the consumer to another replica.
+
+        :param: key: Consumer key. Defaults to the unit name.
+        :param: options: Connection options. None values are ignored.
+        """
+        key = key or self.framework.model.unit.name
+        endpoint = max(
+            self.read_endpoints, key=lambda endpoint: rendezvous_score(key, endpoint)
+        )
+        return self._read_uri(endpoint, options)
+
+    def _read_uri(self, endpoint: str, options: dict) -> str:
+        return "mysql://{}:{}@{}/{}{}".format(
+            self.user, self.password, endpoint, self.database, _query(options)
         )
+
+
+def _endpoints(snapshot: RelationSnapshot) -> Dict[str, str]:
+    return {
+        unit: f"{data['host']}:{data['port']}"
+        for unit, data in snapshot.units_data.items()
+        if data.get("host") and data.get("port")
+    }
+
+
+def _query(options: dict) -> str:
+    options = sorted((k, str(v)) for k, v in options.items() if v is not None)
+    return f"?{urlencode(options)}" if options else ""
@@ -21,41 +21,18 @@ Ported to the Operator Framework from the canonical-osm Reactive
 charms at https://git.launchpad.net/canonical-osm
 """
 
-import ops.charm
-import ops.framework
-import ops.model
+from .common import InterfaceDefinition
 
-from .common import BaseRelationClient
+PROMETHEUS_INTERFACE = InterfaceDefinition(
+    "Prometheus", [("hostname", str), ("port", int)], "app", module=__name__
+)
 
+PrometheusData = PROMETHEUS_INTERFACE.schema
+PrometheusClient = PROMETHEUS_INTERFACE.client_class
 
-class PrometheusServer(ops.framework.Object):
-    """Provides side of a Prometheus Endpoint"""
-
-    relation_name: str = None
 
-    def __init__(self, charm: ops.charm.CharmBase, relation_name: str):
-        super().__init__(charm, relation_name)
-        self.relation_name = relation_name
+class PrometheusServer(PROMETHEUS_INTERFACE.server_class):
+    """Provides side of a Prometheus Endpoint"""
 
     def publish_info(self, hostname: str, port: int = 9091):
-        if self.framework.model.unit.is_leader():
-            for relation in self.framework.model.relations[self.relation_name]:
-                relation.data[self.framework.model.app]["hostname"] = hostname
-                relation.data[self.framework.model.app]["port"] = str(port)
-
-
-class PrometheusClient(BaseRelationClient):
-    """Requires side of a Prometheus Endpoint"""
-
-    mandatory_fields = ["hostname", "port"]
-
-    def __init__(self, charm: ops.charm.CharmBase, relation_name: str):
-        super().__init__(charm, relation_name, self.mandatory_fields)
-
-    @property
-    def hostname(self):
-        return self.get_data_from_app("hostname")
-
-    @property
-    def port(self):
-        return self.get_data_from_app("port")
+        super().publish_info(hostname=hostname, port=port)
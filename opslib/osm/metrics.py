@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# For those usages not covered by the Apache License, Version 2.0 please
+# contact: legal@canonical.com
+#
+# To get in touch with the maintainers, please contact:
+# osm-charmers@lists.launchpad.net
+##
+
+__all__ = [
+    "DURATION_BUCKETS",
+    "SIZE_BUCKETS",
+    "Counter",
+    "Histogram",
+    "MetricsRegistry",
+]
+
+
+import bisect
+import os
+import tempfile
+from typing import Any, Dict, List, Sequence, Tuple
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.series = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(
+                f"{self.name} expects the labels {list(self.labels)}, got {sorted(labels)}"
+            )
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _label_str(self, key: Tuple[str, ...], extra: Dict[str, str] = None) -> str:
+        pairs = list(zip(self.labels, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def dump(self) -> List[list]:
+        return [[list(key), value] for key, value in sorted(self.series.items())]
+
+    def load(self, series: List[list]):
+        if any(len(key) != len(self.labels) for key, _ in series):
+            raise ValueError(f"{self.name} labels changed")
+        self.series = {tuple(key): self._load_value(value) for key, value in series}
+
+    def _load_value(self, value):
+        return value
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {_escape_help(self.documentation)}",
+            f"# TYPE {self.name} {self.type}",
+        ] + self._samples()
+
+
+class Counter(_Metric):
+    """Monotonically increasing value"""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only be increased")
+        key = self._key(labels)
+        self.series[key] = self.series.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.series.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{self._label_str(key)} {_number(value)}"
+            for key, value in sorted(self.series.items())
+        ]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DURATION_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts, total, count = self.series.get(key, ([0] * len(self.buckets), 0, 0))
+        counts = list(counts)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            counts[index] += 1
+        self.series[key] = [counts, total + value, count + 1]
+
+    def count(self, **labels) -> int:
+        return self.series.get(self._key(labels), (None, 0, 0))[2]
+
+    def _load_value(self, value):
+        counts, total, count = value
+        if len(counts) != len(self.buckets):
+            raise ValueError(f"{self.name} buckets changed")
+        return [list(counts), total, count]
+
+    def _samples(self) -> List[str]:
+        samples = []
+        for key, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = self._label_str(key, {"le": _number(bucket)})
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = self._label_str(key, {"le": "+Inf"})
+            samples.append(f"{self.name}_bucket{labels} {count}")
+            samples.append(f"{self.name}_sum{self._label_str(key)} {_number(total)}")
+            samples.append(f"{self.name}_count{self._label_str(key)} {count}")
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Set of metrics, rendered in the Prometheus text exposition format
+
+    The values can be dumped to and loaded from simple types, so they
+    accumulate across hooks when kept in the StoredState. Stored values are
+    applied to the metrics as they are registered.
+
+    :param: stored: Values previously returned by dump()
+    """
+
+    def __init__(self, stored: Dict[str, Any] = None):
+        self.metrics = {}
+        self._stored = dict(stored or {})
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DURATION_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def dump(self) -> Dict[str, Any]:
+        """Values of the metrics, made of simple types"""
+        stored = dict(self._stored)
+        stored.update({name: metric.dump() for name, metric in self.metrics.items()})
+        return stored
+
+    def render(self) -> str:
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+        for name in sorted(self.metrics):
+            lines.extend(self.metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Write the rendered metrics to a file, atomically, e.g. for a textfile collector"""
+        directory = os.path.dirname(path) or "."
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, prefix=".metrics-", delete=False
+        ) as f:
+            f.write(self.render())
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, path)
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        if metric.name in self._stored:
+            try:
+                metric.load(self._stored.pop(metric.name))
+            except (TypeError, ValueError):
+                # Values stored with another definition of the metric are dropped
+                metric.series = {}
+        self.metrics[metric.name] = metric
+        return metric
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
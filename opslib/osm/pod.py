@@ -22,13 +22,81 @@
 
 __all__ = [
     "IngressResourceV3Builder",
+    "FileContentStore",
     "FilesV3Builder",
+    "SizeBudgetExceeded",
+    "PodSpecSizeReport",
+    "analyze_pod_spec_size",
     "ContainerV3Builder",
     "PodSpecV3Builder",
+    "normalize_pod_spec",
 ]
 
+import base64
+import gzip
+import io
+import logging
+import mmap
+import os
+from typing import Any, Dict, Hashable, List, Tuple
 
-class IngressResourceV3Builder:
+from .digest import _key_str, canonical_chunks, spec_digest
+from .frozen import freeze, FrozenDict, FrozenList, thaw
+
+logger = logging.getLogger(__name__)
+
+# Kubernetes limit of the data stored in a ConfigMap. Each volume is a ConfigMap.
+CONFIGMAP_SIZE_LIMIT = 1024 * 1024
+# Default etcd request size limit, which bounds any Kubernetes object
+POD_SPEC_SIZE_LIMIT = 1536 * 1024
+# Fraction of a limit from which the size analyzer logs a warning
+SIZE_WARNING_RATIO = 0.8
+# Files to compress bigger than this are memory-mapped when read
+MMAP_MIN_SIZE = 64 * 1024
+
+
+class _SnapshotMixin:
+    """
+    Memoized build() result
+
+    Builders describe their output in _snapshot_data, and snapshot() freezes
+    it only once. The snapshot is dropped when an attribute is assigned or
+    when a builder method calls _invalidate_snapshot. Snapshots share the
+    frozen objects they contain, so building them again after a mutation
+    does not copy the parts that did not change.
+
+    build() returns a mutable copy of the snapshot, made of plain dicts and
+    lists, so charms can still modify the result and dump it with any YAML
+    dumper. Passing snapshots to other builders shares them instead.
+    """
+
+    _snapshot = None
+
+    def __setattr__(self, name, value):
+        if name != "_snapshot":
+            object.__setattr__(self, "_snapshot", None)
+        object.__setattr__(self, name, value)
+
+    def _invalidate_snapshot(self):
+        self._snapshot = None
+
+    def _snapshot_data(self):
+        raise NotImplementedError()
+
+    def snapshot(self):
+        """Immutable, memoized build() result"""
+        if self._snapshot is None:
+            self._snapshot = freeze(self._snapshot_data())
+        return self._snapshot
+
+    def build(self):
+        return thaw(self.snapshot())
+
+    def digest(self) -> str:
+        return spec_digest(self.snapshot())
+
+
+class IngressResourceV3Builder(_SnapshotMixin):
     def __init__(self, name, annotations):
         self.name = name
         self.annotations = annotations
@@ -37,71 +105,283 @@ class IngressResourceV3Builder:
 
     @property
     def rules(self):
-        return self._rules
+        return thaw(self._rules)
 
     @property
     def tls(self):
-        return self._tls
+        return thaw(self._tls)
 
     @property
     def ingress_resource(self):
+        return self.build()
+
+    def _snapshot_data(self):
         r = {
             "name": self.name,
             "annotations": self.annotations,
-            "spec": {"rules": self.rules},
+            "spec": {"rules": FrozenList(self._rules)},
         }
         if self._tls:
-            r["spec"]["tls"] = self.tls
+            r["spec"]["tls"] = FrozenList(self._tls)
         return r
 
     def add_rule(self, hostname: str, service_name, port, path: str = "/"):
+        self._invalidate_snapshot()
         # This function only supports one path per rule for simplicity
         self._rules.append(
-            {
-                "host": hostname,
-                "http": {
-                    "paths": [
-                        {
-                            "path": path,
-                            "backend": {
-                                "serviceName": service_name,
-                                "servicePort": port,
-                            },
-                        }
-                    ]
-                },
-            }
+            freeze(
+                {
+                    "host": hostname,
+                    "http": {
+                        "paths": [
+                            {
+                                "path": path,
+                                "backend": {
+                                    "serviceName": service_name,
+                                    "servicePort": port,
+                                },
+                            }
+                        ]
+                    },
+                }
+            )
         )
 
     def add_tls(self, hosts, secret_name):
+        self._invalidate_snapshot()
         tls = {"hosts": hosts}
         if secret_name:
             tls["secretName"] = secret_name
-        self._tls.append(tls)
+        self._tls.append(freeze(tls))
 
-    def build(self):
-        return self.ingress_resource
 
+class FileContentStore:
+    """
+    Content-addressed store of file contents
+
+    Identical contents added by any builder sharing the store are kept only
+    once, as a single string object, and hashed only once. Pod spec v3 has
+    no way of referencing a file from another volume, so the serialized
+    spec still contains every copy.
+
+    Each FilesV3Builder has its own store unless one is passed to it, so
+    deduplicating across builders is opt-in and the store lives as long as
+    the builders using it.
+    """
 
-class FilesV3Builder:
     def __init__(self):
+        self._digests = {}
+        self._blobs = {}
+        self._sizes = {}
+        self._files = {}
+        self._references = {}
+
+    def add(self, content: str, key: Hashable) -> str:
+        """
+        Add a file content to the store
+
+        :param: content: File content
+        :param: key: Identifier of the logical file, e.g. its builder and index.
+                     Adding a file again replaces its previous content, so
+                     rebuilding a builder does not count its files twice.
+
+        :return: Stored instance of the content, to use instead of the argument
+        """
+        digest = self._digests.get(content)
+        if digest is None:
+            digest = spec_digest(content)
+            self._digests[content] = digest
+            content = self._blobs.setdefault(digest, content)
+            self._sizes[digest] = len(content.encode())
+        previous = self._files.get(key)
+        if previous != digest:
+            self._files[key] = digest
+            self._references[digest] = self._references.get(digest, 0) + 1
+            if previous is not None:
+                self._release(previous)
+        return self._blobs[digest]
+
+    def get(self, digest: str) -> str:
+        return self._blobs[digest]
+
+    def size(self, content: str) -> int:
+        """Size in bytes of a content added to the store"""
+        return self._sizes[self._digests[content]]
+
+    def digest(self, content: str) -> str:
+        return self._digests[content]
+
+    def report(self) -> Dict[str, int]:
+        """
+        Deduplication report
+
+        :return: Dictionary with the number of files and unique blobs added,
+                 and their total, unique and deduplicated sizes in bytes
+        """
+        total_bytes = sum(self._sizes[digest] for digest in self._files.values())
+        unique_bytes = sum(self._sizes.values())
+        return {
+            "files": len(self._files),
+            "unique_blobs": len(self._blobs),
+            "total_bytes": total_bytes,
+            "unique_bytes": unique_bytes,
+            "deduplicated_bytes": total_bytes - unique_bytes,
+        }
+
+    def _release(self, digest: str):
+        # Contents no longer used by any file are dropped
+        self._references[digest] -= 1
+        if not self._references[digest]:
+            del self._references[digest]
+            del self._digests[self._blobs.pop(digest)]
+            del self._sizes[digest]
+
+
+class SizeBudgetExceeded(Exception):
+    def __init__(self, name: str, size: int, budget: int):
+        self.name = name
+        self.size = size
+        self.budget = budget
+        self.message = f"{name} is {size} bytes, over the {budget} bytes budget"
+
+    def __str__(self):
+        return self.message
+
+
+class _LazyFile:
+    """File whose content is only read when the builder is built"""
+
+    def __init__(self, path: str, get_source_path, mode: int, compress: bool):
+        self.path = path
+        self.get_source_path = get_source_path
+        self.mode = mode
+        self.compress = compress
+
+    def file_spec(self, store: "FileContentStore", key: Hashable) -> Dict[str, Any]:
+        if not self.compress:
+            # The content ends up as a str anyway, a mapping would only add a copy
+            with open(self.get_source_path(), encoding="utf-8") as f:
+                return _file_spec(self.path, f.read(), self.mode, False, store, key)
+        with open(self.get_source_path(), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < MMAP_MIN_SIZE:
+                data = f.read()
+                return _file_spec(self.path, data, self.mode, self.compress, store, key)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return _file_spec(self.path, data, self.mode, self.compress, store, key)
+
+
+class FilesV3Builder(_SnapshotMixin):
+    def __init__(
+        self,
+        store: FileContentStore = None,
+        size_budget: int = CONFIGMAP_SIZE_LIMIT,
+    ):
         self._files = []
+        self.store = store or FileContentStore()
+        self.size_budget = size_budget
 
     @property
     def files(self):
-        return self._files
+        return self.build()
+
+    def _snapshot_data(self):
+        # Files are keyed by their index, so duplicated paths are counted apart
+        files = [
+            f.file_spec(self.store, (self, index)) if isinstance(f, _LazyFile) else f
+            for index, f in enumerate(self._files)
+        ]
+        size = sum(len(f["path"]) + self.store.size(f["content"]) for f in files)
+        if self.size_budget and size > self.size_budget:
+            raise SizeBudgetExceeded("Files", size, self.size_budget)
+        return files
+
+    def add_file(self, path: str, content: str, mode: int = None, compress: bool = False):
+        """
+        Add a file with the given content
+
+        :param: path: Path of the file in the volume
+        :param: content: Content of the file
+        :param: mode: File mode
+        :param: compress: Store the content gzipped and base64 encoded. The file
+                          in the workload then holds that text, and the workload
+                          has to decode and decompress it.
+        """
+        self._invalidate_snapshot()
+        data = content.encode() if compress else content
+        key = (self, len(self._files))
+        self._files.append(freeze(_file_spec(path, data, mode, compress, self.store, key)))
+
+    def add_file_from_path(
+        self, path: str, source_path: str, mode: int = None, compress: bool = False
+    ):
+        """
+        Add a file whose content is read from the local filesystem
+
+        The source is only read when the builder is built. Large sources
+        to compress are memory-mapped instead of read into intermediate
+        buffers; uncompressed sources are read as UTF-8 text, since the pod
+        spec holds the whole content as a string.
+
+        :param: path: Path of the file in the volume
+        :param: source_path: Path of the file in the charm filesystem
+        :param: mode: File mode
+        :param: compress: Store the content gzipped and base64 encoded. The file
+                          in the workload then holds that text, and the workload
+                          has to decode and decompress it.
+        """
+        self._invalidate_snapshot()
+        self._files.append(_LazyFile(path, lambda: source_path, mode, compress))
+
+    def add_file_from_resource(
+        self,
+        path: str,
+        resources,
+        resource_name: str,
+        mode: int = None,
+        compress: bool = False,
+    ):
+        """
+        Add a file whose content is a charm resource
+
+        The resource is only fetched and read when the builder is built.
+
+        :param: path: Path of the file in the volume
+        :param: resources: Model resources (charm.model.resources)
+        :param: resource_name: Name of the resource
+        :param: mode: File mode
+        :param: compress: Store the content gzipped and base64 encoded. The file
+                          in the workload then holds that text, and the workload
+                          has to decode and decompress it.
+        """
+        self._invalidate_snapshot()
+        self._files.append(
+            _LazyFile(path, lambda: resources.fetch(resource_name), mode, compress)
+        )
 
-    def add_file(self, path: str, content: str, mode: int = None):
-        file_spec = {"path": path, "content": content}
-        if mode:
-            file_spec.update({"mode": mode})
-        self._files.append(file_spec)
 
-    def build(self):
-        return self.files
+def _file_spec(
+    path: str, data, mode: int, compress: bool, store: FileContentStore, key: Hashable
+):
+    if compress:
+        content = _gzip_base64(data)
+    else:
+        content = data
+    file_spec = {"path": path, "content": store.add(content, key)}
+    if mode:
+        file_spec.update({"mode": mode})
+    return file_spec
+
 
+def _gzip_base64(data) -> str:
+    buffer = io.BytesIO()
+    # A fixed mtime keeps the output, and so the pod spec hash, stable
+    with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as f:
+        f.write(data)
+    return base64.b64encode(buffer.getvalue()).decode()
 
-class ContainerV3Builder:
+
+class ContainerV3Builder(_SnapshotMixin):
     def __init__(self, name, image_info, image_pull_policy="Always"):
         self.name = name
         self.image_info = image_info
@@ -115,38 +395,44 @@ class ContainerV3Builder:
 
     @property
     def readiness_probe(self):
-        return self._readiness_probe
+        return thaw(self._readiness_probe)
 
     @property
     def liveness_probe(self):
-        return self._liveness_probe
+        return thaw(self._liveness_probe)
 
     @property
     def ports(self):
-        return self._ports
+        return thaw(self._ports)
 
     @property
     def env_config(self):
-        return self._envs
+        return thaw(self._envs)
 
     @property
     def command(self):
-        return self._command
+        return thaw(self._command)
 
     @property
     def volume_config(self):
-        return self._volume_config
+        return thaw(self._volume_config)
 
     def add_port(self, name, port, protocol="TCP"):
-        self._ports.append({"name": name, "containerPort": port, "protocol": protocol})
+        self._invalidate_snapshot()
+        self._ports.append(
+            freeze({"name": name, "containerPort": port, "protocol": protocol})
+        )
 
     def add_volume_config(self, name, mount_path, files):
+        self._invalidate_snapshot()
         self._volume_config.append(
-            {
-                "name": name,
-                "mountPath": mount_path,
-                "files": files,
-            }
+            freeze(
+                {
+                    "name": name,
+                    "mountPath": mount_path,
+                    "files": files,
+                }
+            )
         )
 
     def add_command(self, command):
@@ -249,31 +535,32 @@ class ContainerV3Builder:
         }
 
     def add_env(self, key: str, value: str):
+        self._invalidate_snapshot()
         self._envs[key] = value
 
     def add_envs(self, envs: dict):
         self._envs = {**self._envs, **envs}
 
-    def build(self):
+    def _snapshot_data(self):
         container = {
             "name": self.name,
             "imageDetails": self.image_info,
             "imagePullPolicy": self.image_pull_policy,
-            "ports": self.ports,
-            "envConfig": self.env_config,
-            "volumeConfig": self.volume_config,
+            "ports": FrozenList(self._ports),
+            "envConfig": self._envs,
+            "volumeConfig": FrozenList(self._volume_config),
             "kubernetes": {},
         }
-        if self.command:
-            container["command"] = self.command
-        if self.readiness_probe:
-            container["kubernetes"]["readinessProbe"] = self.readiness_probe
-        if self.liveness_probe:
-            container["kubernetes"]["livenessProbe"] = self.liveness_probe
+        if self._command:
+            container["command"] = self._command
+        if self._readiness_probe:
+            container["kubernetes"]["readinessProbe"] = self._readiness_probe
+        if self._liveness_probe:
+            container["kubernetes"]["livenessProbe"] = self._liveness_probe
         return container
 
 
-class PodSpecV3Builder:
+class PodSpecV3Builder(_SnapshotMixin):
     def __init__(self):
         self._init_containers = []
         self._containers = []
@@ -282,43 +569,311 @@ class PodSpecV3Builder:
 
     @property
     def containers(self):
-        return self._containers
+        return thaw(self._containers)
 
     @property
     def init_containers(self):
-        return self._init_containers
+        return thaw(self._init_containers)
 
     @property
     def ingress_resources(self):
-        return self._ingress_resources
+        return thaw(self._ingress_resources)
 
     @property
     def security_context(self):
-        return self._security_context
+        return thaw(self._security_context)
 
     @property
     def pod_spec(self):
+        return self.build()
+
+    def _snapshot_data(self):
         return {
             "version": 3,
             # "initContainers": self.init_containers,
-            "containers": self.containers,
+            "containers": FrozenList(self._containers),
             "kubernetesResources": {
-                "ingressResources": self.ingress_resources,
-                "pod": {"securityContext": self.security_context},
+                "ingressResources": FrozenList(self._ingress_resources),
+                "pod": {"securityContext": self._security_context},
             },
         }
 
     def add_init_container(self, container):
-        self._init_containers.append(container)
+        self._invalidate_snapshot()
+        self._init_containers.append(freeze(container))
 
     def add_container(self, container):
-        self._containers.append(container)
+        self._invalidate_snapshot()
+        self._containers.append(freeze(container))
 
     def add_ingress_resource(self, ingress_resource):
-        self._ingress_resources.append(ingress_resource)
+        self._invalidate_snapshot()
+        self._ingress_resources.append(freeze(ingress_resource))
+
+    def analyze_size(self) -> "PodSpecSizeReport":
+        return analyze_pod_spec_size(self.snapshot())
 
     def set_security_context_fs_group(self, fs_group: int):
+        self._invalidate_snapshot()
         self._security_context.update({"fsGroup": fs_group})
 
-    def build(self):
-        return self.pod_spec
+
+class PodSpecSizeReport:
+    """Serialized sizes of the parts of a pod spec, and the limits that apply to them"""
+
+    def __init__(self, sizes: Dict[str, int], limits: Dict[str, int]):
+        self.sizes = sizes
+        self.limits = limits
+
+    @property
+    def total(self) -> int:
+        return self.sizes["podSpec"]
+
+    def over(self, ratio: float = 1) -> List[Tuple[str, int, int]]:
+        """Parts whose size is over the given fraction of their limit"""
+        return [
+            (name, self.sizes[name], limit)
+            for name, limit in self.limits.items()
+            if self.sizes[name] > limit * ratio
+        ]
+
+    def check(self, warning_ratio: float = SIZE_WARNING_RATIO):
+        """
+        Log the parts close to their limit, and fail if any is over it
+
+        :raises: SizeBudgetExceeded
+        """
+        for name, size, limit in self.over(warning_ratio):
+            logger.warning(f"{name} is {size} bytes, {size * 100 // limit}% of {limit}")
+        for name, size, limit in self.over():
+            raise SizeBudgetExceeded(name, size, limit)
+
+    def __str__(self):
+        return "\n".join(f"{size:>10} {name}" for name, size in self.sizes.items())
+
+
+def analyze_pod_spec_size(
+    pod_spec: Dict[str, Any],
+    pod_spec_limit: int = POD_SPEC_SIZE_LIMIT,
+    volume_limit: int = CONFIGMAP_SIZE_LIMIT,
+) -> PodSpecSizeReport:
+    """
+    Compute the serialized size of each part of a pod spec
+
+    Sizes are reported for the whole spec, each container, its environment,
+    each volume and file, and each ingress resource.
+
+    :param: pod_spec: Pod spec
+    :param: pod_spec_limit: Maximum size of the whole pod spec
+    :param: volume_limit: Maximum size of the files of a volume
+
+    :return: PodSpecSizeReport
+    """
+    size = _SerializedSizes()
+    sizes = {"podSpec": size(pod_spec)}
+    limits = {"podSpec": pod_spec_limit}
+    for container in pod_spec.get("containers", []) + pod_spec.get("initContainers", []):
+        prefix = f"containers[{container.get('name')}]"
+        sizes[prefix] = size(container)
+        sizes[f"{prefix}.envConfig"] = size(container.get("envConfig", {}))
+        for volume in container.get("volumeConfig", []):
+            volume_name = f"{prefix}.volumeConfig[{volume.get('name')}]"
+            sizes[volume_name] = size(volume.get("files", []))
+            limits[volume_name] = volume_limit
+            for f in volume.get("files", []):
+                sizes[f"{volume_name}.files[{f.get('path')}]"] = size(f)
+    kubernetes_resources = pod_spec.get("kubernetesResources", {})
+    for ingress_resource in kubernetes_resources.get("ingressResources", []):
+        name = f"ingressResources[{ingress_resource.get('name')}]"
+        sizes[name] = size(ingress_resource)
+    return PodSpecSizeReport(sizes, limits)
+
+
+class _SerializedSizes:
+    """
+    Serialized sizes of a value and its parts, each computed only once
+
+    Only the scalars are serialized. The size of a dict or a list is the sum
+    of the sizes of its items plus the delimiters, and is cached, so sizing
+    a part of a value already sized does not serialize it again.
+    """
+
+    def __init__(self):
+        # Values are kept with their size, so their ids are not reused
+        self._sizes = {}
+
+    def __call__(self, value: Any) -> int:
+        if not isinstance(value, (dict, list, tuple)):
+            return _serialized_size(value)
+        cached = self._sizes.get(id(value))
+        if cached is not None:
+            return cached[1]
+        if isinstance(value, dict):
+            # '"key": value'
+            items = [
+                _serialized_size(_key_str(key)) + 2 + self(item)
+                for key, item in value.items()
+            ]
+        else:
+            items = [self(item) for item in value]
+        # Brackets, and ", " between the items
+        size = 2 + sum(items) + 2 * max(len(items) - 1, 0)
+        self._sizes[id(value)] = (value, size)
+        return size
+
+
+def _serialized_size(value: Any) -> int:
+    # The canonical encoding is ASCII, so characters are bytes
+    return sum(len(chunk) for chunk in canonical_chunks(value))
+
+
+def normalize_pod_spec(pod_spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Canonical form of a pod spec
+
+    Numeric ports are converted to integers, numeric environment values to
+    strings, and the collections whose order does not matter (ports, volumes,
+    files, ingress resources, rules and tls) are sorted. Semantically equal
+    pod specs therefore get the same fingerprint.
+
+    Only the parts that change are copied: the other ones are shared with
+    the argument, so frozen snapshots keep their memoized digests.
+
+    :param: pod_spec: Pod spec. It is not modified.
+
+    :return: Normalized pod spec
+    """
+    changes = {}
+    for key in ("containers", "initContainers"):
+        if pod_spec.get(key):
+            changes[key] = _mapped(pod_spec[key], _normalize_container)
+    kubernetes_resources = pod_spec.get("kubernetesResources")
+    if kubernetes_resources and kubernetes_resources.get("ingressResources"):
+        ingress_resources = _sorted_by(
+            _mapped(kubernetes_resources["ingressResources"], _normalize_ingress_resource),
+            "name",
+        )
+        changes["kubernetesResources"] = _updated(
+            kubernetes_resources, {"ingressResources": ingress_resources}
+        )
+    return _updated(pod_spec, changes)
+
+
+def _normalize_container(container: Dict[str, Any]) -> Dict[str, Any]:
+    changes = {}
+    if container.get("ports"):
+        ports = _mapped(container["ports"], lambda port: _normalize_port(port, "containerPort"))
+        changes["ports"] = _sorted_by(ports, "containerPort", "protocol", "name")
+    if container.get("volumeConfig"):
+        volumes = _mapped(container["volumeConfig"], _normalize_volume)
+        changes["volumeConfig"] = _sorted_by(volumes, "name")
+    if container.get("envConfig"):
+        envs = container["envConfig"]
+        changes["envConfig"] = _updated(
+            envs,
+            {
+                key: str(value)
+                for key, value in envs.items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)
+            },
+        )
+    if container.get("kubernetes"):
+        kubernetes = container["kubernetes"]
+        changes["kubernetes"] = _updated(
+            kubernetes,
+            {
+                name: _normalize_probe(probe)
+                for name, probe in kubernetes.items()
+                if isinstance(probe, dict)
+            },
+        )
+    return _updated(container, changes)
+
+
+def _normalize_volume(volume: Dict[str, Any]) -> Dict[str, Any]:
+    if not volume.get("files"):
+        return volume
+    return _updated(volume, {"files": _sorted_by(volume["files"], "path")})
+
+
+def _normalize_probe(probe: Dict[str, Any]) -> Dict[str, Any]:
+    return _updated(
+        probe,
+        {
+            action: _normalize_port(probe[action], "port")
+            for action in ("httpGet", "tcpSocket")
+            if probe.get(action)
+        },
+    )
+
+
+def _normalize_ingress_resource(ingress_resource: Dict[str, Any]) -> Dict[str, Any]:
+    spec = ingress_resource.get("spec")
+    if not spec:
+        return ingress_resource
+    changes = {}
+    if spec.get("rules"):
+        changes["rules"] = _sorted_by(_mapped(spec["rules"], _normalize_rule), "host")
+    if spec.get("tls"):
+        changes["tls"] = _sorted_by(_mapped(spec["tls"], _normalize_tls), "secretName", "hosts")
+    return _updated(ingress_resource, {"spec": _updated(spec, changes)})
+
+
+def _normalize_rule(rule: Dict[str, Any]) -> Dict[str, Any]:
+    http = rule.get("http")
+    if not http or not http.get("paths"):
+        return rule
+    paths = _sorted_by(_mapped(http["paths"], _normalize_path), "path")
+    return _updated(rule, {"http": _updated(http, {"paths": paths})})
+
+
+def _normalize_path(path: Dict[str, Any]) -> Dict[str, Any]:
+    if not path.get("backend"):
+        return path
+    return _updated(path, {"backend": _normalize_port(path["backend"], "servicePort")})
+
+
+def _normalize_tls(tls: Dict[str, Any]) -> Dict[str, Any]:
+    hosts = tls.get("hosts")
+    if not isinstance(hosts, list) or hosts == sorted(hosts):
+        return tls
+    return _updated(tls, {"hosts": _like(hosts, sorted(hosts))})
+
+
+def _normalize_port(spec: Dict[str, Any], key: str) -> Dict[str, Any]:
+    # Named ports (e.g. "http") are kept as they are
+    if spec and isinstance(spec.get(key), str) and spec[key].isdigit():
+        return _updated(spec, {key: int(spec[key])})
+    return spec
+
+
+def _sort_key(item: Dict[str, Any], keys: Tuple[str, ...]) -> tuple:
+    return tuple(str(item.get(key, "")) for key in keys)
+
+
+def _sorted_by(items: list, *keys: str) -> list:
+    sort_keys = [_sort_key(item, keys) for item in items]
+    if sort_keys == sorted(sort_keys):
+        return items
+    return _like(items, sorted(items, key=lambda item: _sort_key(item, keys)))
+
+
+def _mapped(items: list, function) -> list:
+    new_items = [function(item) for item in items]
+    if all(new is old for new, old in zip(new_items, items)):
+        return items
+    return _like(items, new_items)
+
+
+def _updated(mapping: Dict[str, Any], changes: Dict[str, Any]) -> Dict[str, Any]:
+    # The mapping itself is returned if no value changed
+    if all(mapping.get(key) is value for key, value in changes.items()):
+        return mapping
+    return _like(mapping, {**mapping, **changes})
+
+
+def _like(original, new):
+    # Copies of frozen containers are frozen too; their unchanged items are shared
+    if isinstance(original, (FrozenDict, FrozenList)):
+        return type(original)(new)
+    return new
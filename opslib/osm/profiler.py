@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# For those usages not covered by the Apache License, Version 2.0 please
+# contact: legal@canonical.com
+#
+# To get in touch with the maintainers, please contact:
+# osm-charmers@lists.launchpad.net
+##
+
+__all__ = ["PhaseProfile", "HookProfile", "HookProfiler"]
+
+
+from contextlib import contextmanager
+import os
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from .backend import InstrumentedBackend
+
+
+class PhaseProfile(NamedTuple):
+    name: str
+    wall_time: float
+    cpu_time: float
+    # None if the hook tool calls were not counted
+    hook_tool_calls: Optional[int]
+
+    def __str__(self):
+        if self.hook_tool_calls is None:
+            return f"{self.name}: {self.wall_time:.3f}s"
+        return f"{self.name}: {self.wall_time:.3f}s/{self.hook_tool_calls}"
+
+
+class HookProfile:
+    """Phases of a hook, with the time and hook tool calls spent in each of them"""
+
+    def __init__(self, hook: str, started: float, phases: List[PhaseProfile]):
+        self.hook = hook
+        self.started = started
+        self.phases = phases
+
+    @property
+    def wall_time(self) -> float:
+        return sum(phase.wall_time for phase in self.phases)
+
+    @property
+    def cpu_time(self) -> float:
+        return sum(phase.cpu_time for phase in self.phases)
+
+    @property
+    def hook_tool_calls(self) -> Optional[int]:
+        calls = [p.hook_tool_calls for p in self.phases if p.hook_tool_calls is not None]
+        return sum(calls) if calls else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Representation made of simple types, suitable for the StoredState"""
+        return {
+            "hook": self.hook,
+            "started": self.started,
+            "phases": [list(phase) for phase in self.phases],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "HookProfile":
+        phases = [PhaseProfile(*phase) for phase in data["phases"]]
+        return cls(data["hook"], data["started"], phases)
+
+    def __str__(self):
+        phases = ", ".join(str(phase) for phase in self.phases)
+        calls = ""
+        if self.hook_tool_calls is not None:
+            calls = f", {self.hook_tool_calls} hook tool calls"
+        return (
+            f"{self.hook}: {self.wall_time:.3f}s wall, {self.cpu_time:.3f}s cpu"
+            f"{calls} ({phases})"
+        )
+
+
+class HookProfiler:
+    """
+    Per-phase timing of a hook
+
+        with profiler.phase("build"):
+            pod_spec = self.build_pod_spec(image_info)
+
+    :param: backend: Instrumented model backend counting the hook tool calls.
+                     Without it, the hook tool calls are not counted.
+    """
+
+    def __init__(self, backend: InstrumentedBackend = None):
+        self.hook = os.path.basename(os.environ.get("JUJU_DISPATCH_PATH", "")) or "unknown"
+        self.started = time.time()
+        self.phases = []
+        self.backend = backend
+
+    @contextmanager
+    def phase(self, name: str):
+        """Context manager recording the time and hook tool calls of a phase"""
+        calls = self._calls()
+        wall, cpu = time.monotonic(), time.process_time()
+        try:
+            yield
+        finally:
+            self.phases.append(
+                PhaseProfile(
+                    name,
+                    time.monotonic() - wall,
+                    time.process_time() - cpu,
+                    None if calls is None else self._calls() - calls,
+                )
+            )
+
+    def profile(self) -> HookProfile:
+        return HookProfile(self.hook, self.started, list(self.phases))
+
+    def _calls(self) -> Optional[int]:
+        return self.backend.calls if self.backend else None
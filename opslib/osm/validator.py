@@ -55,6 +55,13 @@ class ValidationError(Exception):
 
 
 class ModelValidator:
+    __validation_plan__ = ()
+    __decorator_validators__ = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.__validation_plan__, cls.__decorator_validators__ = _compile_model(cls)
+
     def __init__(self, **data: Any):
         data = {k.replace("-", "_"): v for k, v in data.items()}
 
@@ -66,49 +73,64 @@ class ModelValidator:
         setattr(self, "__dict__", values)
 
 
-def validate_model(model, data):
-    validation_exceptions = []
-    model_attributes = getattr(model, "__annotations__")
-    __decorator_validators__ = {
+def _compile_model(model):
+    """
+    Compile the validation plan of a model
+
+    The plan is a tuple of (attr_name, optional, type_to_check, args_type),
+    one per annotated attribute. It is computed once, when the model class
+    is defined, so that every instantiation only has to run it.
+    """
+    model_attributes = getattr(model, "__annotations__", {})
+    plan = tuple(
+        (
+            attr_name,
+            _is_optional_type(attr_type),
+            _safe_get_type(attr_type),
+            _safe_get_args(attr_type),
+        )
+        for attr_name, attr_type in model_attributes.items()
+    )
+    decorator_validators = {
         validator.argument: validator
         for validator in model.__dict__.values()
         if hasattr(validator, "decorator")
     }
+    return plan, decorator_validators
+
+
+def validate_model(model, data):
+    if "__validation_plan__" not in model.__dict__:
+        model.__validation_plan__, model.__decorator_validators__ = _compile_model(
+            model
+        )
+    return _run_plan(
+        model.__validation_plan__, model.__decorator_validators__, data
+    )
+
+
+def _run_plan(plan, decorator_validators, data):
+    validation_exceptions = []
     error = None
     values = {}
-    # extra_attributes = [key for key in data if key not in model_attributes]
-    # if extra_attributes:
-    #     for extra_attr in extra_attributes:
-    #         validation_exceptions.append(
-    #             AttributeError(extra_attr, AttributeErrorTypes.UNDEFINED)
-    #         )
-
-    for attr_name, attr_type in model_attributes.items():
-        optional = _is_optional_type(attr_type)
-        type_to_check = _safe_get_type(attr_type)
-        args_type = _safe_get_args(attr_type)
 
+    for attr_name, optional, type_to_check, args_type in plan:
         data_value = data.get(attr_name)
         if data_value is None and not optional:
             validation_exceptions.append(
                 AttributeError(attr_name, AttributeErrorTypes.MISSING)
             )
         else:
-            error_msg = ""
             try:
                 _validate(data_value, type_to_check, args_type)
-                if attr_name in __decorator_validators__:
-                    data[attr_name] = __decorator_validators__[attr_name](data_value)
+                if attr_name in decorator_validators:
+                    data[attr_name] = decorator_validators[attr_name](data_value)
             except Exception as e:
-                error_msg = str(e)
-                validation_exceptions.append(AttributeError(attr_name, error_msg))
-                continue
+                validation_exceptions.append(AttributeError(attr_name, str(e)))
     if validation_exceptions:
         error = ValidationError(exceptions=validation_exceptions)
     else:
-        values.update(
-            {attr_name: data.get(attr_name) for attr_name in model_attributes}
-        )
+        values.update({attr_name: data.get(attr_name) for attr_name, *_ in plan})
 
     return values, error
 
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+from typing import NoReturn
+import unittest
+
+import mock
+from opslib.osm.backend import HookToolReport, HookToolStats, InstrumentedBackend
+from opslib.osm.charm import CharmedOsmBase
+from opslib.osm.interfaces.kafka import KafkaClient
+from ops.testing import Harness
+
+
+class InstrumentedCharm(CharmedOsmBase):
+    instrument_backend = True
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.kafka = KafkaClient(self, "kafka")
+
+
+class TestInstrumentedBackend(unittest.TestCase):
+    def setUp(self) -> NoReturn:
+        self.harness = Harness(
+            InstrumentedCharm,
+            meta="name: lcm\nrequires:\n  kafka:\n    interface: kafka\n",
+        )
+        self.harness.set_leader(is_leader=True)
+        self.harness.begin()
+        relation_id = self.harness.add_relation("kafka", "kafka")
+        self.harness.add_relation_unit(relation_id, "kafka/0")
+        self.harness.update_relation_data(
+            relation_id, "kafka/0", {"host": "kafka", "port": "9092"}
+        )
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_calls_by_caller(self, mock_build_pod_spec) -> NoReturn:
+        mock_build_pod_spec.side_effect = lambda _: {
+            "version": 3,
+            "containers": [
+                {"name": "lcm", "envConfig": {"KAFKA": self.harness.charm.kafka.host}}
+            ],
+        }
+        self.harness.charm.on.config_changed.emit()
+        report = self.harness.charm.hook_tools.report()
+        callers = report.by_caller()
+        self.assertGreaterEqual(callers["KafkaClient"].calls, 1)
+        self.assertGreaterEqual(callers["InstrumentedCharm"].calls, 1)
+        self.assertIn("pod-spec-set", report.by_command())
+        self.assertEqual(report.calls, self.harness.charm.hook_tools.calls)
+        with self.assertLogs("opslib.osm.charm", "DEBUG") as logs:
+            self.harness.framework.commit()
+        self.assertTrue(any("Hook tools: KafkaClient" in line for line in logs.output))
+        phases = {p.name: p for p in self.harness.charm.hook_profiles[-1].phases}
+        self.assertGreaterEqual(phases["set_spec"].hook_tool_calls, 1)
+
+    def test_without_callers(self) -> NoReturn:
+        backend = InstrumentedBackend(self.harness.charm.model)
+        self.harness.charm.model._backend.is_leader()
+        self.assertEqual(list(backend.report().stats), [("all", "is-leader")])
+
+
+class TestHookToolReport(unittest.TestCase):
+    def test_report(self) -> NoReturn:
+        report = HookToolReport(
+            {
+                ("MysqlClient", "relation-get"): HookToolStats(3, 0.3),
+                ("MysqlClient", "relation-list"): HookToolStats(1, 0.1),
+                ("Charm", "relation-get"): HookToolStats(2, 0.4),
+            }
+        )
+        self.assertEqual(report.calls, 6)
+        self.assertEqual(report.by_command()["relation-get"].calls, 5)
+        self.assertEqual(report.by_caller()["MysqlClient"].calls, 4)
+        self.assertEqual(report.lines()[0], "Charm relation-get: 2 calls, 0.400s")
+        self.assertIn("6 hook tool calls", str(report))
+
+
+if __name__ == "__main__":
+    unittest.main()
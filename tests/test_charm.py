@@ -1,13 +1,20 @@
 #!/usr/bin/env python3
 
 import base64
+import hashlib
+import json
+import os
 import sys
+import tempfile
 from typing import NoReturn
 import unittest
 
 import mock
-from opslib.osm.charm import CharmedOsmBase
-from ops.model import ActiveStatus, WaitingStatus
+from opslib.osm.charm import CharmedOsmBase, RelationsMissing
+from opslib.osm.diff import decompress_pod_spec
+from opslib.osm.digest import FINGERPRINT_SCHEME, spec_fingerprint
+from opslib.osm.pod import analyze_pod_spec_size, PodSpecV3Builder
+from ops.model import ActiveStatus, BlockedStatus, ModelError, WaitingStatus
 from ops.testing import Harness
 
 
@@ -37,6 +44,361 @@ class TestCharm(unittest.TestCase):
         self.harness.charm.on.config_changed.emit()
         self.assertIsInstance(self.harness.charm.unit.status, ActiveStatus)
 
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_unchanged_inputs_skip_build(self, mock_build_pod_spec) -> NoReturn:
+        mock_build_pod_spec.return_value = {"version": 3, "containers": []}
+        self.harness.charm.on.config_changed.emit()
+        self.harness.charm.on.config_changed.emit()
+        self.assertEqual(mock_build_pod_spec.call_count, 1)
+        self.assertIsInstance(self.harness.charm.unit.status, ActiveStatus)
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_changed_inputs_rebuild(self, mock_build_pod_spec) -> NoReturn:
+        mock_build_pod_spec.return_value = {"version": 3, "containers": []}
+        self.harness.charm.on.config_changed.emit()
+        with mock.patch(
+            "opslib.osm.charm.CharmedOsmBase.pod_spec_inputs",
+            return_value={"config": {"port": 9090}},
+        ):
+            self.harness.charm.on.config_changed.emit()
+        self.assertEqual(mock_build_pod_spec.call_count, 2)
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_upgrade_charm_rebuilds(self, mock_build_pod_spec) -> NoReturn:
+        mock_build_pod_spec.return_value = {"version": 3, "containers": []}
+        self.harness.charm.on.config_changed.emit()
+        self.harness.charm.on.upgrade_charm.emit()
+        self.harness.charm.on.config_changed.emit()
+        self.assertEqual(mock_build_pod_spec.call_count, 2)
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_legacy_pod_spec_hash_not_reapplied(self, mock_build_pod_spec) -> NoReturn:
+        pod_spec = {"version": 3, "containers": [{"name": "c1"}]}
+        mock_build_pod_spec.return_value = pod_spec
+        self.harness.charm.state.pod_spec = hashlib.md5(
+            json.dumps(pod_spec, sort_keys=True).encode()
+        ).hexdigest()
+        with mock.patch.object(self.harness.charm.model.pod, "set_spec") as set_spec:
+            self.harness.charm.on.config_changed.emit()
+        set_spec.assert_not_called()
+        self.assertEqual(
+            self.harness.charm.state.pod_spec, spec_fingerprint(pod_spec)
+        )
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_legacy_hash_of_raw_pod_spec_not_reapplied(
+        self, mock_build_pod_spec
+    ) -> NoReturn:
+        # Legacy fingerprints were computed before the env values were normalized
+        pod_spec = {
+            "version": 3,
+            "containers": [{"name": "nbi", "envConfig": {"OSMNBI_SERVER_PORT": 9999}}],
+        }
+        mock_build_pod_spec.return_value = pod_spec
+        self.harness.charm.state.pod_spec = hashlib.md5(
+            json.dumps(pod_spec, sort_keys=True).encode()
+        ).hexdigest()
+        with mock.patch.object(self.harness.charm.model.pod, "set_spec") as set_spec:
+            self.harness.charm.on.config_changed.emit()
+        set_spec.assert_not_called()
+        self.assertTrue(
+            self.harness.charm.state.pod_spec.startswith(FINGERPRINT_SCHEME)
+        )
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.should_apply_pod_spec")
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_pod_spec_diff_not_applied(
+        self, mock_build_pod_spec, mock_should_apply_pod_spec
+    ) -> NoReturn:
+        mock_build_pod_spec.return_value = {"version": 3, "containers": []}
+        self.harness.charm.on.config_changed.emit()
+        mock_build_pod_spec.return_value = {"version": 3, "containers": [{"name": "c1"}]}
+        mock_should_apply_pod_spec.return_value = False
+        with mock.patch.object(
+            self.harness.charm.model.pod, "set_spec"
+        ) as set_spec, mock.patch(
+            "opslib.osm.charm.CharmedOsmBase.pod_spec_inputs",
+            return_value={"config": {"port": 9090}},
+        ):
+            self.harness.charm.on.config_changed.emit()
+            self.harness.charm.on.config_changed.emit()
+        set_spec.assert_not_called()
+        self.assertEqual(mock_build_pod_spec.call_count, 3)
+        diff = mock_should_apply_pod_spec.call_args[0][0]
+        self.assertEqual([str(change) for change in diff], ["added containers[c1]"])
+        self.assertIs(self.harness.charm.last_pod_spec_diff, diff)
+        self.assertFalse(diff.applied)
+        self.assertEqual(
+            self.harness.charm.unit.status,
+            WaitingStatus(f"Pod spec changes pending: {diff.summary()}"),
+        )
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_changed_pod_spec_hashed_once(self, mock_build_pod_spec) -> NoReturn:
+        mock_build_pod_spec.return_value = {"version": 3, "containers": [{"name": "c1"}]}
+        self.harness.charm.state.pod_spec = spec_fingerprint({"version": 3})
+        with mock.patch("opslib.osm.charm.matches_fingerprint") as matches:
+            self.harness.charm.on.config_changed.emit()
+        matches.assert_not_called()
+        self.assertEqual(
+            self.harness.charm.state.pod_spec,
+            spec_fingerprint(mock_build_pod_spec.return_value),
+        )
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_snapshot_digests_memoized(self, mock_build_pod_spec) -> NoReturn:
+        pod_spec_builder = PodSpecV3Builder()
+        pod_spec_builder.add_container({"name": "c1", "envConfig": {"KEY": "value"}})
+        snapshot = pod_spec_builder.snapshot()
+        mock_build_pod_spec.return_value = snapshot
+        self.harness.charm.on.config_changed.emit()
+        self.assertIsInstance(self.harness.charm.unit.status, ActiveStatus)
+        self.assertIn("blake2b", snapshot["containers"]._digests)
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_secrets_not_stored(self, mock_build_pod_spec) -> NoReturn:
+        mock_build_pod_spec.return_value = {
+            "version": 3,
+            "containers": [{"name": "c1", "envConfig": {"PASSWORD": "secret"}}],
+        }
+        self.harness.charm.on.config_changed.emit()
+        stored = decompress_pod_spec(self.harness.charm.state.pod_spec_data)
+        self.assertNotIn("secret", json.dumps(stored))
+        mock_build_pod_spec.return_value = {
+            "version": 3,
+            "containers": [{"name": "c1", "envConfig": {"PASSWORD": "other"}}],
+        }
+        self.harness.charm.on.upgrade_charm.emit()
+        self.harness.charm.on.config_changed.emit()
+        diff = self.harness.charm.last_pod_spec_diff
+        self.assertEqual(
+            [str(change) for change in diff], ["changed containers[c1].envConfig.PASSWORD"]
+        )
+        self.assertTrue(diff.applied)
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_pod_spec_too_big(self, mock_build_pod_spec) -> NoReturn:
+        mock_build_pod_spec.return_value = {
+            "version": 3,
+            "containers": [{"name": "c1", "envConfig": {"KEY": "x" * 100}}],
+        }
+        with mock.patch(
+            "opslib.osm.charm.analyze_pod_spec_size",
+            side_effect=lambda spec: analyze_pod_spec_size(spec, pod_spec_limit=100),
+        ), mock.patch.object(self.harness.charm.model.pod, "set_spec") as set_spec:
+            self.harness.charm.on.config_changed.emit()
+        set_spec.assert_not_called()
+        self.assertIsInstance(self.harness.charm.unit.status, BlockedStatus)
+        self.assertIn("podSpec is", self.harness.charm.unit.status.message)
+
+
+class PrefetchCharm(CharmedOsmBase):
+    prefetch_relations = True
+
+
+class TestCharmPrefetch(unittest.TestCase):
+    def setUp(self) -> NoReturn:
+        self.harness = Harness(
+            PrefetchCharm,
+            meta="""
+                name: test
+                requires:
+                  kafka:
+                    interface: kafka
+                  mongodb:
+                    interface: mongodb
+            """,
+        )
+        self.harness.set_leader(is_leader=True)
+        self.harness.begin()
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_prefetch(self, mock_build_pod_spec) -> NoReturn:
+        mock_build_pod_spec.return_value = {"version": 3, "containers": []}
+        for relation_name, app in (("kafka", "kafka-k8s"), ("mongodb", "mongodb-k8s")):
+            relation_id = self.harness.add_relation(relation_name, app)
+            self.harness.add_relation_unit(relation_id, f"{app}/0")
+        self.harness.charm.on.config_changed.emit()
+        report = self.harness.charm.prefetch_report
+        self.assertEqual(
+            sorted(name.split("/", 1)[1] for name in report.reads),
+            ["kafka-k8s", "kafka-k8s/0", "mongodb-k8s", "mongodb-k8s/0"],
+        )
+        self.assertGreaterEqual(report.serial_time, 0)
+        self.assertIn("4 relation data reads", str(report))
+        self.assertEqual(report.errors, {})
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_prefetch_read_error(self, mock_build_pod_spec) -> NoReturn:
+        mock_build_pod_spec.return_value = {"version": 3, "containers": []}
+        relation_id = self.harness.add_relation("kafka", "kafka-k8s")
+        self.harness.add_relation_unit(relation_id, "kafka-k8s/0")
+        backend = self.harness.charm.model._backend
+        relation_get = backend.relation_get
+        app_reads = []
+
+        def failing_relation_get(*args, **kwargs):
+            if "kafka-k8s" in args:
+                app_reads.append(args)
+                if len(app_reads) == 1:
+                    raise ModelError("relation-get failed")
+            return relation_get(*args, **kwargs)
+
+        with mock.patch.object(backend, "relation_get", failing_relation_get):
+            self.harness.charm.on.config_changed.emit()
+            report = self.harness.charm.prefetch_report
+            self.assertEqual(
+                report.errors, {f"kafka:{relation_id}/kafka-k8s": "relation-get failed"}
+            )
+            self.assertIn("1 failed", str(report))
+            relation = self.harness.charm.model.get_relation("kafka")
+            self.assertEqual(dict(relation.data[relation.app]), {})
+        self.assertEqual(len(app_reads), 2)
+        self.assertIsInstance(self.harness.charm.unit.status, ActiveStatus)
+
+
+class CoalescingCharm(CharmedOsmBase):
+    coalesce_configure_pod = True
+
+
+class TestCharmCoalescing(unittest.TestCase):
+    def setUp(self) -> NoReturn:
+        self.harness = Harness(CoalescingCharm)
+        self.harness.set_leader(is_leader=True)
+        self.harness.begin()
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_single_build_per_dispatch(self, mock_build_pod_spec) -> NoReturn:
+        mock_build_pod_spec.return_value = {"version": 3, "containers": []}
+        inputs = iter(range(10))
+        with mock.patch(
+            "opslib.osm.charm.CharmedOsmBase.pod_spec_inputs",
+            side_effect=lambda _: {"config": {"revision": next(inputs)}},
+        ):
+            self.harness.charm.on.config_changed.emit()
+            self.harness.charm.on.leader_elected.emit()
+            self.harness.charm.on.config_changed.emit()
+            mock_build_pod_spec.assert_not_called()
+            self.assertEqual(self.harness.charm.configure_pod_requests, 3)
+            self.harness.framework.commit()
+            self.harness.framework.commit()
+        self.assertEqual(mock_build_pod_spec.call_count, 1)
+        self.assertIsInstance(self.harness.charm.unit.status, ActiveStatus)
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_status_reflects_outcome(self, mock_build_pod_spec) -> NoReturn:
+        mock_build_pod_spec.side_effect = RelationsMissing(["kafka"])
+        self.harness.charm.on.config_changed.emit()
+        self.harness.charm.on.config_changed.emit()
+        self.harness.framework.commit()
+        self.assertEqual(mock_build_pod_spec.call_count, 1)
+        self.assertEqual(
+            self.harness.charm.unit.status, BlockedStatus("Need kafka relation")
+        )
+
+
+class TestCharmProfiler(unittest.TestCase):
+    def setUp(self) -> NoReturn:
+        self.harness = Harness(
+            CharmedOsmBase, meta="name: test\n", actions="hook-profiles: {}\n"
+        )
+        self.harness.set_leader(is_leader=True)
+        self.harness.begin()
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_hook_profile(self, mock_build_pod_spec) -> NoReturn:
+        mock_build_pod_spec.return_value = {"version": 3, "containers": []}
+        self.harness.charm.on.config_changed.emit()
+        self.harness.framework.commit()
+        profiles = self.harness.charm.hook_profiles
+        self.assertEqual(len(profiles), 1)
+        phases = {phase.name: phase for phase in profiles[0].phases}
+        self.assertEqual(
+            sorted(phases), ["build", "diff", "hash", "image", "inputs", "set_spec"]
+        )
+        self.assertGreaterEqual(profiles[0].cpu_time, 0)
+        # Hook tool calls are only counted when the backend is instrumented
+        self.assertIsNone(self.harness.charm.hook_tools)
+        self.assertNotIn("pod_spec_set", vars(self.harness.charm.model._backend))
+        self.assertIsNone(profiles[0].hook_tool_calls)
+        self.assertNotIn("hook tool calls", str(profiles[0]))
+
+    def test_profile_history_bounded(self) -> NoReturn:
+        self.harness.charm.profile_history = 3
+        for i in range(5):
+            with self.harness.charm.profiler.phase(f"phase-{i}"):
+                pass
+            self.harness.framework.commit()
+        profiles = self.harness.charm.hook_profiles
+        self.assertEqual(len(profiles), 3)
+        self.assertEqual([p.phases[-1].name for p in profiles], ["phase-2", "phase-3", "phase-4"])
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_metrics_disabled(self, mock_build_pod_spec) -> NoReturn:
+        mock_build_pod_spec.return_value = {"version": 3, "containers": []}
+        self.harness.charm.on.config_changed.emit()
+        self.harness.framework.commit()
+        self.assertEqual(self.harness.charm.state.metrics, {})
+
+    def test_hook_profiles_action(self) -> NoReturn:
+        with self.harness.charm.profiler.phase("build"):
+            pass
+        self.harness.framework.commit()
+        self.assertTrue(hasattr(self.harness.charm.on, "hook_profiles_action"))
+        # Harness.run_action is not available in the pinned ops
+        event = mock.Mock()
+        self.harness.charm._on_hook_profiles_action(event)
+        results = event.set_results.call_args[0][0]
+        self.assertEqual(json.loads(results["profiles"])[0]["phases"][0][0], "build")
+        self.assertIn("build:", results["summary"])
+
+
+class TestCharmMetrics(unittest.TestCase):
+    def setUp(self) -> NoReturn:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "charm.prom")
+        charm_class = type("MetricsCharm", (CharmedOsmBase,), {"metrics_path": self.path})
+        self.harness = Harness(
+            charm_class, meta="name: test\nrequires:\n  mysql:\n    interface: mysql\n"
+        )
+        self.harness.set_leader(is_leader=True)
+        self.harness.begin()
+        relation_id = self.harness.add_relation("mysql", "mysql")
+        self.harness.add_relation_unit(relation_id, "mysql/0")
+        self.harness.update_relation_data(relation_id, "mysql/0", {"host": "mysql"})
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_metrics(self, mock_build_pod_spec) -> NoReturn:
+        mock_build_pod_spec.return_value = {"version": 3, "containers": []}
+        self.harness.charm.on.config_changed.emit()
+        self.harness.charm.on.config_changed.emit()
+        self.harness.framework.commit()
+        metrics = self.harness.charm.metrics.render()
+        self.assertIn("osm_charm_pod_spec_builds_total 1\n", metrics)
+        self.assertIn("osm_charm_pod_spec_applies_total 1\n", metrics)
+        self.assertIn('osm_charm_pod_spec_skips_total{reason="inputs_unchanged"} 1\n', metrics)
+        self.assertIn('osm_charm_hook_duration_seconds_count{hook="unknown"} 1\n', metrics)
+        self.assertIn('osm_charm_relation_payload_bytes_count{relation="mysql"} 2\n', metrics)
+        stored = self.harness.charm.state.metrics
+        self.assertEqual(stored["osm_charm_pod_spec_builds_total"], [[[], 1]])
+        with open(self.path) as f:
+            self.assertEqual(f.read(), metrics)
+
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.pod_spec_inputs")
+    @mock.patch("opslib.osm.charm.CharmedOsmBase.build_pod_spec")
+    def test_payload_sizes_with_custom_inputs(
+        self, mock_build_pod_spec, mock_pod_spec_inputs
+    ) -> NoReturn:
+        mock_build_pod_spec.return_value = {"version": 3, "containers": []}
+        mock_pod_spec_inputs.return_value = {"relations": ["mysql"]}
+        self.harness.charm.on.config_changed.emit()
+        self.assertIsInstance(self.harness.charm.unit.status, ActiveStatus)
+        self.assertIn(
+            'osm_charm_relation_payload_bytes_count{relation="mysql"} 1\n',
+            self.harness.charm.metrics.render(),
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+
+from opslib.osm.diff import (
+    ChangeCategories,
+    compress_pod_spec,
+    decompress_pod_spec,
+    diff_pod_specs,
+    redact_pod_spec,
+)
+
+
+def pod_spec(envs=None, content="global:\n", rules_host="hostname", ports=(9090,)):
+    return {
+        "version": 3,
+        "containers": [
+            {
+                "name": "app",
+                "ports": [
+                    {"name": f"port-{p}", "containerPort": p, "protocol": "TCP"}
+                    for p in ports
+                ],
+                "envConfig": envs or {"LOG_LEVEL": "INFO"},
+                "volumeConfig": [
+                    {
+                        "name": "config",
+                        "mountPath": "/etc/app",
+                        "files": [{"path": "app.yml", "content": content}],
+                    }
+                ],
+                "kubernetes": {"readinessProbe": {"tcpSocket": {"port": 9090}}},
+            }
+        ],
+        "kubernetesResources": {
+            "ingressResources": [
+                {
+                    "name": "app-ingress",
+                    "annotations": {},
+                    "spec": {"rules": [{"host": rules_host}]},
+                }
+            ]
+        },
+    }
+
+
+class TestDiff(unittest.TestCase):
+    def test_no_changes(self):
+        diff = diff_pod_specs(pod_spec(), pod_spec())
+        self.assertFalse(diff)
+        self.assertEqual(diff.summary(), "no changes")
+
+    def test_env_and_file_changes(self):
+        diff = diff_pod_specs(
+            pod_spec(), pod_spec(envs={"LOG_LEVEL": "DEBUG"}, content="other")
+        )
+        self.assertEqual(
+            [str(change) for change in diff],
+            [
+                "changed containers[app].envConfig.LOG_LEVEL",
+                "changed containers[app].volumeConfig[config].files[app.yml].content",
+            ],
+        )
+        self.assertEqual(
+            diff.categories, {ChangeCategories.ENV: 1, ChangeCategories.FILES: 1}
+        )
+        self.assertTrue(diff.restart_required)
+
+    def test_ingress_change_no_restart(self):
+        diff = diff_pod_specs(pod_spec(), pod_spec(rules_host="other"))
+        self.assertEqual(diff.categories, {ChangeCategories.INGRESS: 2})
+        self.assertFalse(diff.restart_required)
+
+    def test_reordered_items_not_changed(self):
+        diff = diff_pod_specs(pod_spec(ports=(9090, 8080)), pod_spec(ports=(8080, 9090)))
+        self.assertFalse(diff)
+
+    def test_unknown_previous_spec(self):
+        diff = diff_pod_specs(None, pod_spec())
+        self.assertTrue(all(change.kind == "added" for change in diff))
+
+    def test_compression_round_trip(self):
+        spec = pod_spec(content="x" * 100000)
+        data = compress_pod_spec(spec)
+        self.assertLess(len(data), 1000)
+        self.assertEqual(decompress_pod_spec(data), spec)
+        self.assertIsNone(decompress_pod_spec(None))
+
+    def test_redacted_changes(self):
+        spec = pod_spec(envs={"PASSWORD": "secret"}, content="password: secret")
+        redacted = redact_pod_spec(spec)
+        self.assertNotIn("secret", repr(decompress_pod_spec(compress_pod_spec(redacted))))
+        self.assertEqual(redacted["kubernetesResources"], spec["kubernetesResources"])
+        self.assertEqual(spec["containers"][0]["envConfig"], {"PASSWORD": "secret"})
+        self.assertFalse(diff_pod_specs(redacted, redact_pod_spec(spec)))
+        diff = diff_pod_specs(
+            redacted, redact_pod_spec(pod_spec(envs={"PASSWORD": "other"}, content="other"))
+        )
+        self.assertEqual(
+            diff.categories, {ChangeCategories.ENV: 1, ChangeCategories.FILES: 1}
+        )
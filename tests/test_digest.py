@@ -0,0 +1,94 @@
+import hashlib
+import json
+import unittest
+
+import mock
+from opslib.osm import digest
+from opslib.osm.digest import (
+    canonical_chunks,
+    matches_fingerprint,
+    spec_digest,
+    spec_fingerprint,
+    stream_digest,
+)
+from opslib.osm.frozen import freeze, thaw
+
+
+class TestDigest(unittest.TestCase):
+    def test_key_order_independent(self):
+        self.assertEqual(
+            spec_digest({"a": 1, "b": [1, "2"]}), spec_digest({"b": [1, "2"], "a": 1})
+        )
+
+    def test_different_values(self):
+        self.assertNotEqual(spec_digest({"a": [1]}), spec_digest({"a": ["1"]}))
+        self.assertNotEqual(spec_digest({"a": [1, 2]}), spec_digest({"a": [[1, 2]]}))
+
+    def test_blob_hashed_once(self):
+        content = "x" * digest.BLOB_MIN_SIZE + "unique-blob"
+        spec = {"files": [{"path": "a", "content": content}]}
+        spec_digest(spec)
+        with mock.patch("opslib.osm.digest._scalar_digest") as mock_digest:
+            mock_digest.return_value = b""
+            spec_digest(spec)
+            hashed = [call.args[0] for call in mock_digest.call_args_list]
+        self.assertNotIn(content, hashed)
+
+    def test_blob_cache_bounded_by_size(self):
+        contents = [str(i) * digest.BLOB_MIN_SIZE for i in range(4)]
+        with mock.patch.object(digest, "BLOB_CACHE_BYTES", 2 * digest.BLOB_MIN_SIZE):
+            for content in contents:
+                spec_digest(content)
+            cached = [value for _, value in digest._blob_digests]
+            self.assertEqual(cached[-2:], contents[-2:])
+            self.assertNotIn(contents[0], cached)
+            self.assertLessEqual(digest._blob_cache_bytes, digest.BLOB_CACHE_BYTES)
+            too_big = "x" * (digest.BLOB_CACHE_BYTES + 1)
+            spec_digest(too_big)
+            self.assertNotIn(too_big, [value for _, value in digest._blob_digests])
+
+    def test_matches_fingerprint(self):
+        spec = {"version": 3, "containers": [{"name": "c1"}]}
+        legacy = hashlib.md5(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+        self.assertTrue(matches_fingerprint(spec, legacy))
+        self.assertTrue(matches_fingerprint(spec, spec_fingerprint(spec)))
+        self.assertFalse(matches_fingerprint({"version": 3}, legacy))
+        self.assertFalse(matches_fingerprint(spec, None))
+
+    def test_canonical_chunks_match_json(self):
+        values = [
+            {},
+            [],
+            {"b": [1, 2.5, None, True], "a": {"y": "\u00f1\n\"", "x": ()}},
+            {1: "int key", 2: {"nested": [{}]}},
+            {"content": "\u20ac" * (digest.CHUNK_SIZE * 2 + 3)},
+            object,
+        ]
+        for value in values:
+            self.assertEqual(
+                "".join(canonical_chunks(value)),
+                json.dumps(value, sort_keys=True, default=str),
+            )
+
+    def test_stream_digest(self):
+        spec = {"version": 3, "containers": [{"name": "c1", "ports": [9090]}]}
+        self.assertEqual(
+            stream_digest(spec, "md5"),
+            hashlib.md5(json.dumps(spec, sort_keys=True).encode()).hexdigest(),
+        )
+        self.assertEqual(
+            stream_digest(spec),
+            stream_digest({"containers": [{"ports": [9090], "name": "c1"}], "version": 3}),
+        )
+
+    def test_matches_previous_merkle_scheme(self):
+        spec = {"version": 3}
+        self.assertTrue(matches_fingerprint(spec, f"merkle-md5:{spec_digest(spec, 'md5')}"))
+
+    def test_frozen_digest_cached(self):
+        spec = freeze({"containers": [{"name": "c1", "envConfig": {"A": "1"}}]})
+        value = spec_digest(spec)
+        self.assertEqual(value, spec_digest(thaw(spec)))
+        with mock.patch("opslib.osm.digest._scalar_digest") as mock_digest:
+            self.assertEqual(value, spec_digest(spec))
+        mock_digest.assert_not_called()
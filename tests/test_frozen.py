@@ -0,0 +1,43 @@
+import copy
+import json
+import unittest
+
+import yaml
+from opslib.osm.frozen import freeze, FrozenDict, FrozenList, thaw
+
+
+class TestFrozen(unittest.TestCase):
+    def test_freeze_deep(self):
+        frozen = freeze({"a": [{"b": 1}], "c": (1, 2)})
+        self.assertIsInstance(frozen, FrozenDict)
+        self.assertIsInstance(frozen["a"], FrozenList)
+        self.assertIsInstance(frozen["a"][0], FrozenDict)
+        self.assertEqual(frozen, {"a": [{"b": 1}], "c": [1, 2]})
+        self.assertIs(freeze(frozen), frozen)
+
+    def test_mutations_raise(self):
+        frozen = freeze({"a": [1]})
+        for mutation in (
+            lambda: frozen.update({"b": 2}),
+            lambda: frozen.pop("a"),
+            lambda: frozen.__setitem__("b", 2),
+            lambda: frozen["a"].append(2),
+            lambda: frozen["a"].sort(),
+        ):
+            with self.assertRaises(TypeError):
+                mutation()
+
+    def test_thaw(self):
+        frozen = freeze({"a": [{"b": 1}]})
+        for thawed in (thaw(frozen), copy.deepcopy(frozen), copy.copy(frozen)):
+            self.assertIs(type(thawed), dict)
+            self.assertIs(type(thawed["a"]), list)
+            thawed["a"].append(2)
+        self.assertEqual(frozen, {"a": [{"b": 1}]})
+        self.assertEqual(yaml.safe_load(yaml.safe_dump(thaw(frozen))), frozen)
+
+    def test_json(self):
+        frozen = freeze({"b": [1, "2"], "a": None})
+        self.assertEqual(
+            json.dumps(frozen, sort_keys=True), '{"a": null, "b": [1, "2"]}'
+        )
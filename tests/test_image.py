@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import tempfile
+from typing import NoReturn
+import unittest
+
+import mock
+from opslib.osm.charm import CharmedOsmBase
+from ops.model import BlockedStatus
+from ops.testing import Harness
+
+OCIImageResourceError = sys.modules["oci_image"].OCIImageResourceError
+
+
+class TestCachedImageResource(unittest.TestCase):
+    def setUp(self) -> NoReturn:
+        self.harness = Harness(CharmedOsmBase)
+        self.harness.set_leader(is_leader=True)
+        self.harness.begin()
+        self.image = self.harness.charm.image
+        self.image.resource = mock.Mock()
+        self.image_info = {
+            "imagePath": "opensourcemano/lcm:10",
+            "username": "mano",
+            "password": "secret",
+        }
+        self.image.resource.fetch.return_value = self.image_info
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "image.yaml")
+        with open(self.path, "w") as f:
+            f.write(
+                "registrypath: opensourcemano/lcm:10\nusername: mano\npassword: secret\n"
+            )
+        patcher = mock.patch.object(self.image, "_resource_path", return_value=self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def new_hook(self):
+        # Every hook runs in a new process, where only the StoredState remains
+        self.image._image_info = None
+
+    def test_cached_while_file_unchanged(self) -> NoReturn:
+        self.assertEqual(self.image.fetch(), self.image_info)
+        self.new_hook()
+        self.assertEqual(self.image.fetch(), self.image_info)
+        self.assertEqual(self.image.resource.fetch.call_count, 1)
+        with open(self.path, "a") as f:
+            f.write("# rotated\n")
+        self.new_hook()
+        self.image.fetch()
+        self.assertEqual(self.image.resource.fetch.call_count, 2)
+
+    def test_credentials_not_stored(self) -> NoReturn:
+        self.image.fetch()
+        self.harness.framework.commit()
+        storage = self.harness.framework._storage
+        stored = storage.load_snapshot(self.image._stored._data.handle.path)
+        self.assertEqual(stored["path"], self.path)
+        self.assertNotIn("secret", str(stored))
+
+    def test_unreadable_file_fetched_again(self) -> NoReturn:
+        self.image.fetch()
+        with open(self.path, "w") as f:
+            f.write("username: mano\n")
+        stat = os.stat(self.path)
+        self.image._stored.stat = [stat.st_mtime_ns, stat.st_size]
+        self.new_hook()
+        self.assertEqual(self.image.fetch(), self.image_info)
+        self.assertEqual(self.image.resource.fetch.call_count, 2)
+
+    def test_cached_in_memory_without_file(self) -> NoReturn:
+        os.remove(self.path)
+        self.image.fetch()
+        self.image.fetch()
+        self.assertEqual(self.image.resource.fetch.call_count, 1)
+        self.new_hook()
+        self.image.fetch()
+        self.assertEqual(self.image.resource.fetch.call_count, 2)
+
+    def test_error_not_retried(self) -> NoReturn:
+        self.image.resource.fetch.side_effect = OCIImageResourceError("image")
+        for _ in range(3):
+            with self.assertRaises(OCIImageResourceError):
+                self.image.fetch()
+        self.assertEqual(self.image.resource.fetch.call_count, 1)
+        self.image.error_retry_interval = 0
+        with self.assertRaises(OCIImageResourceError):
+            self.image.fetch()
+        self.assertEqual(self.image.resource.fetch.call_count, 2)
+
+    def test_upgrade_charm_invalidates(self) -> NoReturn:
+        self.image.resource.fetch.side_effect = OCIImageResourceError("image")
+        self.harness.charm.on.config_changed.emit()
+        self.assertIsInstance(self.harness.charm.unit.status, BlockedStatus)
+        self.image.resource.fetch.side_effect = None
+        self.harness.charm.on.upgrade_charm.emit()
+        self.assertEqual(self.image.fetch(), self.image_info)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+from typing import NoReturn
+import unittest
+
+from opslib.osm.metrics import MetricsRegistry
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def setUp(self) -> NoReturn:
+        self.registry = MetricsRegistry()
+        self.builds = self.registry.counter("builds_total", "Pod specs built")
+        self.durations = self.registry.histogram(
+            "hook_duration_seconds", "Duration of the hooks", ["hook"], buckets=[0.1, 1]
+        )
+
+    def test_render(self) -> NoReturn:
+        self.builds.inc()
+        self.builds.inc(2)
+        self.durations.observe(0.05, hook="config-changed")
+        self.durations.observe(0.5, hook="config-changed")
+        self.durations.observe(3, hook='say "hi"')
+        self.assertEqual(
+            self.registry.render(),
+            "# HELP builds_total Pod specs built\n"
+            "# TYPE builds_total counter\n"
+            "builds_total 3\n"
+            "# HELP hook_duration_seconds Duration of the hooks\n"
+            "# TYPE hook_duration_seconds histogram\n"
+            'hook_duration_seconds_bucket{hook="config-changed",le="0.1"} 1\n'
+            'hook_duration_seconds_bucket{hook="config-changed",le="1"} 2\n'
+            'hook_duration_seconds_bucket{hook="config-changed",le="+Inf"} 2\n'
+            'hook_duration_seconds_sum{hook="config-changed"} 0.55\n'
+            'hook_duration_seconds_count{hook="config-changed"} 2\n'
+            'hook_duration_seconds_bucket{hook="say \\"hi\\"",le="0.1"} 0\n'
+            'hook_duration_seconds_bucket{hook="say \\"hi\\"",le="1"} 0\n'
+            'hook_duration_seconds_bucket{hook="say \\"hi\\"",le="+Inf"} 1\n'
+            'hook_duration_seconds_sum{hook="say \\"hi\\""} 3\n'
+            'hook_duration_seconds_count{hook="say \\"hi\\""} 1\n',
+        )
+
+    def test_labels(self) -> NoReturn:
+        with self.assertRaises(ValueError):
+            self.durations.observe(1)
+        with self.assertRaises(ValueError):
+            self.builds.inc(-1)
+        with self.assertRaises(ValueError):
+            self.registry.counter("builds_total", "Pod specs built")
+
+    def test_dump_and_load(self) -> NoReturn:
+        self.builds.inc()
+        self.durations.observe(0.5, hook="config-changed")
+        registry = MetricsRegistry(self.registry.dump())
+        builds = registry.counter("builds_total", "Pod specs built")
+        durations = registry.histogram(
+            "hook_duration_seconds", "Duration of the hooks", ["hook"], buckets=[0.1, 1]
+        )
+        builds.inc()
+        durations.observe(0.2, hook="config-changed")
+        self.assertEqual(builds.get(), 2)
+        self.assertEqual(durations.count(hook="config-changed"), 2)
+
+    def test_load_changed_definition(self) -> NoReturn:
+        self.durations.observe(0.5, hook="config-changed")
+        registry = MetricsRegistry(self.registry.dump())
+        durations = registry.histogram("hook_duration_seconds", "Duration", buckets=[1])
+        self.assertEqual(durations.series, {})
+
+    def test_write(self) -> NoReturn:
+        self.builds.inc()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "charm.prom")
+            self.registry.write(path)
+            with open(path) as f:
+                self.assertEqual(f.read(), self.registry.render())
+            self.assertEqual(os.listdir(directory), ["charm.prom"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,25 @@
+import base64
+import gzip
+import json
+import os
+import tempfile
 import unittest
 
+import mock
+import yaml
+
 from opslib.osm.pod import (
     IngressResourceV3Builder,
+    FileContentStore,
     FilesV3Builder,
     ContainerV3Builder,
     PodSpecV3Builder,
+    analyze_pod_spec_size,
+    normalize_pod_spec,
+    SizeBudgetExceeded,
 )
+from opslib.osm.digest import canonical_chunks, spec_fingerprint
+from opslib.osm.frozen import freeze, FrozenDict
 
 from typing import Optional, List, Dict, Tuple, Set
 
@@ -137,3 +151,318 @@ class TestPodSpecBuilder(unittest.TestCase):
                 },
             },
         )
+
+
+class TestBuilderDigest(unittest.TestCase):
+    def test_digest_invalidated_on_mutation(self):
+        container_builder = ContainerV3Builder("app", {"imagePath": "image"})
+        container_builder.add_port(name="app", port=9090)
+        digest = container_builder.digest()
+        self.assertEqual(digest, container_builder.digest())
+        container_builder.add_env("KEY", "value")
+        self.assertNotEqual(digest, container_builder.digest())
+        digest = container_builder.digest()
+        container_builder.image_pull_policy = "IfNotPresent"
+        self.assertNotEqual(digest, container_builder.digest())
+
+    def test_equal_specs_equal_digest(self):
+        digests = []
+        for envs in ({"A": "1", "B": "2"}, {"B": "2", "A": "1"}):
+            files_builder = FilesV3Builder()
+            files_builder.add_file("config.yaml", "key: value\n")
+            container_builder = ContainerV3Builder("app", {"imagePath": "image"})
+            container_builder.add_envs(envs)
+            container_builder.add_volume_config("config", "/etc", files_builder.build())
+            pod_spec_builder = PodSpecV3Builder()
+            pod_spec_builder.add_container(container_builder.build())
+            digests.append(pod_spec_builder.digest())
+        self.assertEqual(digests[0], digests[1])
+
+
+class TestNormalizePodSpec(unittest.TestCase):
+    def _pod_spec(self, port, env_port, reverse=False):
+        files_builder = FilesV3Builder()
+        files = [("a.yml", "a: 1\n"), ("b.yml", "b: 2\n")]
+        for path, content in reversed(files) if reverse else files:
+            files_builder.add_file(path, content)
+        container_builder = ContainerV3Builder("app", {"imagePath": "image"})
+        ports = [("app", port), ("metrics", "9091")]
+        for name, container_port in reversed(ports) if reverse else ports:
+            container_builder.add_port(name=name, port=container_port)
+        container_builder.add_env("PORT", env_port)
+        container_builder.add_http_readiness_probe("/", port)
+        container_builder.add_volume_config("config", "/etc", files_builder.build())
+        ingress_builder = IngressResourceV3Builder("app-ingress", {})
+        hosts = ["a.example.com", "b.example.com"]
+        for host in reversed(hosts) if reverse else hosts:
+            ingress_builder.add_rule(host, "app", port)
+        pod_spec_builder = PodSpecV3Builder()
+        pod_spec_builder.add_container(container_builder.build())
+        pod_spec_builder.add_ingress_resource(ingress_builder.build())
+        return pod_spec_builder.build()
+
+    def test_equivalent_specs_same_hash(self):
+        spec = self._pod_spec(9090, 9090)
+        equivalent_spec = self._pod_spec("9090", "9090", reverse=True)
+        self.assertNotEqual(spec_fingerprint(spec), spec_fingerprint(equivalent_spec))
+        self.assertEqual(
+            spec_fingerprint(normalize_pod_spec(spec)),
+            spec_fingerprint(normalize_pod_spec(equivalent_spec)),
+        )
+
+    def test_normalized_values(self):
+        spec = self._pod_spec("9090", 9090)
+        normalized = normalize_pod_spec(spec)
+        container = normalized["containers"][0]
+        self.assertEqual(container["ports"][0]["containerPort"], 9090)
+        self.assertEqual(container["envConfig"]["PORT"], "9090")
+        self.assertEqual(
+            container["kubernetes"]["readinessProbe"]["httpGet"]["port"], 9090
+        )
+        self.assertEqual(spec["containers"][0]["ports"][0]["containerPort"], "9090")
+
+    def test_unchanged_parts_shared(self):
+        spec = freeze(self._pod_spec("9090", "9090"))
+        normalized = normalize_pod_spec(spec)
+        self.assertIsInstance(normalized, FrozenDict)
+        self.assertIs(normalize_pod_spec(normalized), normalized)
+        container, normalized_container = spec["containers"][0], normalized["containers"][0]
+        self.assertIs(normalized_container["envConfig"], container["envConfig"])
+        self.assertIs(normalized_container["volumeConfig"], container["volumeConfig"])
+        self.assertIsNot(normalized_container["ports"], container["ports"])
+
+    def test_named_ports_kept(self):
+        spec = {"containers": [{"name": "app", "ports": [{"containerPort": "http"}]}]}
+        self.assertEqual(normalize_pod_spec(spec), spec)
+
+
+class TestBuilderSnapshots(unittest.TestCase):
+    def test_snapshot_memoized(self):
+        container_builder = ContainerV3Builder("app", {"imagePath": "image"})
+        container_builder.add_port(name="app", port=9090)
+        container = container_builder.snapshot()
+        self.assertIs(container, container_builder.snapshot())
+        container_builder.add_env("KEY", "value")
+        self.assertIsNot(container, container_builder.snapshot())
+        self.assertEqual(container["envConfig"], {})
+
+    def test_snapshot_immutable(self):
+        files_builder = FilesV3Builder()
+        files_builder.add_file("a.yml", "a: 1\n")
+        files = files_builder.snapshot()
+        with self.assertRaises(TypeError):
+            files.append({"path": "b.yml", "content": ""})
+        with self.assertRaises(TypeError):
+            files[0]["content"] = ""
+
+    def test_build_mutable(self):
+        container_builder = ContainerV3Builder("app", {"imagePath": "image"})
+        container_builder.add_port(name="app", port=9090)
+        pod_spec_builder = PodSpecV3Builder()
+        pod_spec_builder.add_container(container_builder.build())
+        pod_spec = pod_spec_builder.build()
+        self.assertIs(type(pod_spec["containers"][0]), dict)
+        pod_spec["containers"][0]["envConfig"]["KEY"] = "value"
+        self.assertEqual(pod_spec_builder.build()["containers"][0]["envConfig"], {})
+        self.assertEqual(
+            yaml.safe_load(yaml.safe_dump(pod_spec_builder.snapshot())),
+            pod_spec_builder.build(),
+        )
+
+    def test_added_objects_copied(self):
+        container = {"name": "app", "ports": []}
+        pod_spec_builder = PodSpecV3Builder()
+        pod_spec_builder.add_container(container)
+        container["ports"].append({"containerPort": 9090})
+        self.assertEqual(pod_spec_builder.build()["containers"], [{"name": "app", "ports": []}])
+
+    def test_snapshots_shared(self):
+        container_builder = ContainerV3Builder("app", {"imagePath": "image"})
+        container = container_builder.snapshot()
+        pod_spec_builder = PodSpecV3Builder()
+        pod_spec_builder.add_container(container)
+        pod_spec = pod_spec_builder.snapshot()
+        self.assertIs(pod_spec["containers"][0], container)
+        pod_spec_builder.set_security_context_fs_group(1000)
+        self.assertIs(pod_spec_builder.snapshot()["containers"][0], container)
+
+
+class TestFileContentStore(unittest.TestCase):
+    def test_deduplication(self):
+        store = FileContentStore()
+        content = "ca-certificate\n" * 100
+        builders = [FilesV3Builder(store), FilesV3Builder(store)]
+        for builder in builders:
+            builder.add_file("ca.crt", "".join(["ca-certificate\n"] * 100))
+            builder.add_file("other.yml", "key: value\n")
+        self.assertIs(
+            builders[0].build()[0]["content"], builders[1].build()[0]["content"]
+        )
+        self.assertEqual(store.get(store.digest(content)), content)
+        self.assertEqual(
+            store.report(),
+            {
+                "files": 4,
+                "unique_blobs": 2,
+                "total_bytes": 2 * (len(content) + 11),
+                "unique_bytes": len(content) + 11,
+                "deduplicated_bytes": len(content) + 11,
+            },
+        )
+
+    def test_rebuilt_files_counted_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source_path = os.path.join(directory, "a.yml")
+            with open(source_path, "w") as f:
+                f.write("a: 1\n")
+            files_builder = FilesV3Builder()
+            files_builder.add_file_from_path("a.yml", source_path)
+            files_builder.build()
+            files_builder.add_file("b.yml", "b: 2\n")
+            files_builder.build()
+            with open(source_path, "w") as f:
+                f.write("a: 2\n")
+            files_builder.add_file("c.yml", "c: 3\n")
+            files_builder.build()
+        report = files_builder.store.report()
+        self.assertEqual(report["files"], 3)
+        self.assertEqual(report["unique_blobs"], 3)
+        self.assertEqual(report["deduplicated_bytes"], 0)
+
+    def test_duplicated_paths(self):
+        files_builder = FilesV3Builder()
+        files_builder.add_file("a.yml", "a: 1\n")
+        files_builder.add_file("a.yml", "a: 2\n")
+        self.assertEqual(
+            [f["content"] for f in files_builder.build()], ["a: 1\n", "a: 2\n"]
+        )
+        self.assertEqual(files_builder.store.report()["files"], 2)
+
+    def test_store_scoped_to_builder(self):
+        self.assertIsNot(FilesV3Builder().store, FilesV3Builder().store)
+
+
+class TestLazyFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_add_file_from_path(self):
+        small = self._write("small.yml", "key: \u00f1\n")
+        big = self._write("big.json", "x" * (1024 * 1024 - 100))
+        files_builder = FilesV3Builder()
+        files_builder.add_file_from_path("small.yml", small, mode=0o644)
+        files_builder.add_file_from_path("big.json", big)
+        with mock.patch("opslib.osm.pod.mmap.mmap") as mmap_mock:
+            files = files_builder.build()
+        # Uncompressed contents are decoded into strings, they are not mapped
+        mmap_mock.assert_not_called()
+        self.assertEqual(
+            files,
+            [
+                {"path": "small.yml", "content": "key: \u00f1\n", "mode": 0o644},
+                {"path": "big.json", "content": "x" * (1024 * 1024 - 100)},
+            ],
+        )
+
+    def test_add_file_from_resource_lazy(self):
+        resources = mock.MagicMock()
+        resources.fetch.return_value = self._write("dashboard.json", "{}")
+        files_builder = FilesV3Builder()
+        files_builder.add_file_from_resource("dashboard.json", resources, "dashboard")
+        resources.fetch.assert_not_called()
+        self.assertEqual(files_builder.build()[0]["content"], "{}")
+        resources.fetch.assert_called_once_with("dashboard")
+
+    def test_compressed_files(self):
+        content = "policy: allow\n" * 1000
+        path = self._write("policy.yml", content)
+        files_builder = FilesV3Builder()
+        files_builder.add_file("inline.yml.gz", content, compress=True)
+        files_builder.add_file_from_path("policy.yml.gz", path, compress=True)
+        files = files_builder.build()
+        self.assertEqual(files[0]["content"], files[1]["content"])
+        self.assertLess(len(files[0]["content"]), len(content) / 10)
+        self.assertEqual(
+            gzip.decompress(base64.b64decode(files[0]["content"])).decode(), content
+        )
+
+    def test_size_budget(self):
+        files_builder = FilesV3Builder(size_budget=1000)
+        files_builder.add_file("big.yml", "x" * 1000)
+        with self.assertRaises(SizeBudgetExceeded):
+            files_builder.build()
+
+
+class TestPodSpecSizeAnalyzer(unittest.TestCase):
+    def _pod_spec_builder(self, content):
+        files_builder = FilesV3Builder()
+        files_builder.add_file("app.yml", content)
+        container_builder = ContainerV3Builder("app", {"imagePath": "image"})
+        container_builder.add_env("LOG_LEVEL", "INFO")
+        container_builder.add_volume_config("config", "/etc/app", files_builder.build())
+        pod_spec_builder = PodSpecV3Builder()
+        pod_spec_builder.add_container(container_builder.build())
+        pod_spec_builder.add_ingress_resource(
+            IngressResourceV3Builder("app-ingress", {}).build()
+        )
+        return pod_spec_builder
+
+    def test_report(self):
+        report = self._pod_spec_builder("x" * 1000).analyze_size()
+        self.assertEqual(
+            list(report.sizes),
+            [
+                "podSpec",
+                "containers[app]",
+                "containers[app].envConfig",
+                "containers[app].volumeConfig[config]",
+                "containers[app].volumeConfig[config].files[app.yml]",
+                "ingressResources[app-ingress]",
+            ],
+        )
+        self.assertEqual(
+            report.sizes["containers[app].envConfig"], len('{"LOG_LEVEL": "INFO"}')
+        )
+        self.assertGreater(report.sizes["containers[app].volumeConfig[config]"], 1000)
+        self.assertGreater(report.total, report.sizes["containers[app]"])
+        self.assertEqual(report.over(), [])
+        report.check()
+
+    def test_sizes_computed_once(self):
+        pod_spec = self._pod_spec_builder("x" * 1000).build()
+        pod_spec["containers"][0]["envConfig"][1] = None
+        with mock.patch(
+            "opslib.osm.pod.canonical_chunks", side_effect=canonical_chunks
+        ) as chunks:
+            report = analyze_pod_spec_size(pod_spec)
+        self.assertEqual(report.total, len(json.dumps(pod_spec)))
+        container = pod_spec["containers"][0]
+        self.assertEqual(
+            report.sizes["containers[app]"], len(json.dumps(container))
+        )
+        self.assertEqual(
+            report.sizes["containers[app].volumeConfig[config]"],
+            len(json.dumps(container["volumeConfig"][0]["files"])),
+        )
+        content = container["volumeConfig"][0]["files"][0]["content"]
+        self.assertEqual(
+            [call for call in chunks.call_args_list if call.args == (content,)],
+            [mock.call(content)],
+        )
+
+    def test_check(self):
+        pod_spec = self._pod_spec_builder("x" * 1000).build()
+        report = analyze_pod_spec_size(pod_spec, volume_limit=1100)
+        with self.assertLogs("opslib.osm.pod", "WARNING"):
+            report.check()
+        report = analyze_pod_spec_size(pod_spec, volume_limit=1000)
+        with self.assertRaises(SizeBudgetExceeded) as e:
+            report.check()
+        self.assertEqual(e.exception.name, "containers[app].volumeConfig[config]")
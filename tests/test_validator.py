@@ -148,4 +148,13 @@ class TestValidator(unittest.TestCase):
         self.assertTrue(raised)
 
     def test_missing_optional_attr(self):
-        ExampleMissingOptionalAttribute(**{})
\ No newline at end of file
+        ExampleMissingOptionalAttribute(**{})
+
+    def test_validation_plan_compiled_on_definition(self):
+        plan = ExampleCustomValidationModel.__validation_plan__
+        self.assertEqual(plan, (("log_level", False, str, ()),))
+        self.assertIn(
+            "log_level", ExampleCustomValidationModel.__decorator_validators__
+        )
+        ExampleCustomValidationModel(**{"log_level": "INFO"})
+        self.assertIs(ExampleCustomValidationModel.__validation_plan__, plan)